@@ -1,12 +1,20 @@
 # app.py
+import pandas as pd
 import streamlit as st
-from database.connection import SessionLocal, init_db
-from services.auth import authenticate_user
+from database.connection import (
+    SessionLocal, ReadSessionLocal, init_db, query_scope, get_page_stats, slow_queries,
+    slow_query_ms, query_debug_default
+)
+from services.auth import try_login
+from services import login_throttle
+from services.session_tokens import (
+    issue_session_token, verify_session_token, token_needs_renewal, client_fingerprint, read_session_cookie, write_session_cookie
+)
 from views.admin_panel import admin_dashboard
 from views.user_panel import user_dashboard
 from views.user_management import user_management_dashboard
-# Importamos la función crítica para el cierre por horario
-from services.admin_service import check_and_auto_close_weeks
+# Cierre por horario: un hilo del proceso duerme hasta el próximo plazo (no se chequea en cada render)
+from services.scheduler import start_auto_close_scheduler
 
 # Importación opcional para Auditoría (Manejo de error por si el archivo no está listo)
 try:
@@ -33,8 +41,9 @@ def show_login_screen():
             submitted = st.form_submit_button("Entrar", use_container_width=True)
             
             if submitted:
+                client = login_throttle.client_key()
                 db = SessionLocal()
-                user = authenticate_user(db, username, password)
+                user, wait = try_login(db, username, password, client)
                 db.close()
                 
                 if user:
@@ -42,22 +51,44 @@ def show_login_screen():
                     st.session_state.user_id = user.id
                     st.session_state.role = user.role
                     st.session_state.user_name = user.full_name
+                    # Token firmado en una cookie: un refresh o una pestaña nueva no vuelve a pedir la contraseña
+                    token = issue_session_token(user, client_fingerprint())
+                    st.session_state.session_token = token
+                    st.session_state.logged_out = False
+                    if token: st.session_state.pending_cookie = token
                     st.success(f"Bienvenido {user.full_name}")
                     st.rerun() # Recargar para entrar al dashboard
                 else:
-                    st.error("❌ Usuario o contraseña incorrectos")
+                    if wait:
+                        st.error(f"⏳ Demasiados intentos. Espere {wait:.0f} segundos e intente de nuevo.")
+                    else:
+                        st.error("❌ Usuario o contraseña incorrectos")
+
+def show_query_footer(scope):
+    """Pie de depuración (solo admins): consultas y tiempo de BD de este rerun."""
+    st.divider()
+    repeated = scope.repeated()
+    st.caption(
+        f"🧪 Página '{scope.page}': {scope.queries} consultas SQL · {scope.seconds * 1000:.0f} ms en BD · "
+        f"{len(scope.slow)} lentas (≥ {slow_query_ms()} ms)"
+    )
+    if repeated:
+        st.warning(f"⚠️ Posible N+1: {len(repeated)} sentencias repetidas muchas veces en este rerun.")
+    with st.expander("Detalle de consultas"):
+        for statement, count in repeated:
+            st.code(f"-- x{count}\n{statement}", language="sql")
+        st.markdown("**Promedio por página**")
+        st.dataframe(pd.DataFrame(get_page_stats()), use_container_width=True, hide_index=True)
+        if slow_queries:
+            st.markdown("**Últimas consultas lentas**")
+            st.dataframe(pd.DataFrame(list(slow_queries)[::-1]), use_container_width=True, hide_index=True)
 
 def main():
     # --- 1. AUTOMATIZACIÓN DE CIERRE (CRÍTICO) ---
-    # Se ejecuta antes de cargar la interfaz para asegurar que si la hora pasó, la semana se cierre.
-    try:
-        db = SessionLocal()
-        closed_count = check_and_auto_close_weeks(db)
-        db.close()
-        if closed_count > 0:
-            print(f"⚠️ SISTEMA: Se cerraron {closed_count} semanas automáticamente por horario.")
-    except Exception as e:
-        print(f"Error en el chequeo de cierre automático: {e}")
+    # El programador se arranca una sola vez por proceso; en los demás reruns no hace nada.
+    start_auto_close_scheduler()
+    # Hash dummy precalculado: los logins de usuarios inexistentes tardan lo mismo desde el primero
+    login_throttle.dummy_password_hash()
 
     # --- 2. GESTIÓN DE ESTADO DE SESIÓN ---
     if "user_id" not in st.session_state:
@@ -67,12 +98,46 @@ def main():
     if "user_name" not in st.session_state:
         st.session_state.user_name = None
 
+    # Cookie pendiente (login o logout del rerun anterior): el script tiene que llegar al navegador,
+    # por eso no se escribe justo antes de un st.rerun()
+    if "pending_cookie" in st.session_state:
+        write_session_cookie(st.session_state.pop("pending_cookie"))
+
+    # Sesión firmada: se valida en cada rerun (HMAC + usuario cacheado, sin bcrypt) para
+    # recuperar el login tras un refresh y cortar sesiones revocadas o vencidas.
+    # La cookie solo se lee para recuperar un login; st.context.cookies no cambia durante
+    # la conexión, así que tras un logout (o una cookie rechazada) no se vuelve a leer.
+    token = st.session_state.get("session_token")
+    if not token and not st.session_state.user_id and not st.session_state.get("logged_out"):
+        token = read_session_cookie()
+    if token:
+        session_user = verify_session_token(token, client_fingerprint())
+        if session_user:
+            # Vigencia corta y deslizante: mientras se usa la app el token se renueva
+            if token_needs_renewal(token):
+                token = issue_session_token(session_user, client_fingerprint()) or token
+                write_session_cookie(token)
+            st.session_state.session_token = token
+            st.session_state.user_id = session_user.id
+            st.session_state.role = session_user.role
+            st.session_state.user_name = session_user.full_name
+        else:
+            write_session_cookie(None)
+            st.session_state.session_token = None
+            st.session_state.logged_out = True
+            st.session_state.user_id = None
+            st.session_state.role = None
+            st.session_state.user_name = None
+
     # --- 3. LOGOUT (SIDEBAR) ---
     if st.session_state.user_id:
         with st.sidebar:
             st.write(f"👤 **{st.session_state.user_name}**")
             st.caption(f"Rol: {st.session_state.role}")
             if st.button("🚪 Cerrar Sesión", use_container_width=True):
+                st.session_state.session_token = None
+                st.session_state.logged_out = True
+                st.session_state.pending_cookie = None
                 st.session_state.user_id = None
                 st.session_state.role = None
                 st.session_state.user_name = None
@@ -80,7 +145,14 @@ def main():
             st.divider()
 
     # --- 4. ROUTER (NAVEGACIÓN) ---
-    
+    # Todo lo que la página consulte a la BD en este rerun queda contado en 'scope'
+    with query_scope("login") as scope:
+        route(scope)
+
+    if st.session_state.role == "admin" and st.session_state.get("show_query_debug"):
+        show_query_footer(scope)
+
+def route(scope):
     # CASO A: NO LOGUEADO
     if not st.session_state.user_id:
         show_login_screen()
@@ -96,13 +168,16 @@ def main():
                 menu_options.insert(2, "Auditoría")
 
             menu_admin = st.sidebar.radio("Navegación Admin", menu_options)
+            st.sidebar.checkbox("🧪 Depurar consultas SQL", key="show_query_debug", value=query_debug_default())
+            scope.page = f"admin/{menu_admin}"
             
             if menu_admin == "Gestionar Semanas/Menú":
                 admin_dashboard(SessionLocal)
             elif menu_admin == "Usuarios":
                 user_management_dashboard(SessionLocal)
             elif menu_admin == "Auditoría" and audit_log_page:
-                audit_log_page(SessionLocal, st.session_state.user_name)
+                # Página de solo lectura: se sirve desde la réplica si hay una
+                audit_log_page(ReadSessionLocal, st.session_state.user_name)
             elif menu_admin == "Mi Pedido (Vista Usuario)":
                 st.subheader("👤 Modo de Prueba: Realizar Pedido")
                 # CORRECCIÓN: user_dashboard no recibe user_id como argumento, lo toma de session_state
@@ -110,6 +185,7 @@ def main():
                 
         # --- ROL USER ---
         elif st.session_state.role == "user":
+            scope.page = "user/Mi Pedido"
             user_dashboard(SessionLocal)
         
         else:
@@ -0,0 +1,18 @@
+# backfill_order_lines.py
+# Regenera la tabla order_lines a partir de Order.details para todos los pedidos.
+# Uso: python backfill_order_lines.py
+
+from database.connection import init_db, SessionLocal
+from services.order_service import backfill_order_lines
+
+init_db() # Aplica las migraciones pendientes (crea order_lines si no existe)
+
+db = SessionLocal()
+try:
+    count = backfill_order_lines(db)
+    print(f"✅ Líneas regeneradas para {count} pedidos.")
+except Exception as e:
+    db.rollback()
+    print(f"❌ Error al regenerar order_lines: {e}")
+finally:
+    db.close()
@@ -0,0 +1,103 @@
+# bench_indexes.py
+# Compara planes (EXPLAIN) y tiempos de las consultas más frecuentes antes y después
+# de los índices compuestos, sobre una base temporal con varios años de historial semanal.
+# Uso: python bench_indexes.py [--weeks 156] [--users 500] [--runs 50]
+# Trabaja sobre una base SQLite temporal: no toca data/db.sqlite.
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import create_engine, insert, text
+from database.models import Base, User, Week, MenuItem, Order, AuditLog, Office
+from database.migrations import ADDED_INDEXES, ensure_indexes
+from services.export_service import DAY_KEYS
+
+TYPES = ["Proteína", "Guarnición", "Plato Completo"]
+
+# Formas de consulta de cada carga de página (mismos filtros que usan las vistas)
+HOT_QUERIES = [
+    ("Pedidos de la semana", "SELECT id, user_id, status FROM orders WHERE week_id = :week_id"),
+    ("Menú del día por tipo",
+     "SELECT id, description FROM menu_items WHERE week_id = :week_id AND day = 'monday' AND type = 'Proteína' ORDER BY option_number"),
+    ("Semana abierta vigente", "SELECT id FROM weeks WHERE is_open = 1 AND end_date > :now"),
+    ("Usuarios activos por oficina", "SELECT id, full_name FROM users WHERE is_active = 1 AND office_id = :office_id"),
+    ("Últimos logs de auditoría", "SELECT id, action FROM audit_logs ORDER BY timestamp DESC LIMIT 100"),
+]
+
+def seed(engine, weeks: int, users: int):
+    rnd = random.Random(7)
+    start = date.today() - timedelta(weeks=weeks)
+    with engine.begin() as conn:
+        conn.execute(insert(Office), [{"id": i, "name": f"Oficina {i}"} for i in range(1, 6)])
+        conn.execute(insert(User), [
+            {"id": i, "username": f"user{i}", "full_name": f"Usuario {i}", "password_hash": "x",
+             "role": "user", "is_active": rnd.random() > 0.2, "office_id": rnd.randint(1, 5)}
+            for i in range(1, users + 1)
+        ])
+        conn.execute(insert(Week), [
+            {"id": w, "title": f"Semana {w}", "start_date": start + timedelta(weeks=w),
+             "end_date": datetime.combine(start + timedelta(weeks=w, days=4), datetime.min.time()),
+             "is_open": w == weeks, "is_finalized": w != weeks, "closed_days": [], "data_version": 0}
+            for w in range(1, weeks + 1)
+        ])
+        conn.execute(insert(MenuItem), [
+            {"week_id": w, "day": d, "type": t, "option_number": o, "description": f"{t} {o}"}
+            for w in range(1, weeks + 1) for d in DAY_KEYS for t in TYPES for o in (1, 2, 3)
+        ])
+        details = json.dumps({d: {"tipo": "nada"} for d in DAY_KEYS})
+        for w in range(1, weeks + 1):
+            conn.execute(insert(Order), [
+                {"user_id": u, "week_id": w, "status": "success", "details": details, "version": 1}
+                for u in range(1, users + 1) if rnd.random() < 0.8
+            ])
+        conn.execute(insert(AuditLog), [
+            {"actor_id": "admin", "target_username": f"user{rnd.randint(1, users)}", "action": "UPDATE",
+             "timestamp": datetime.now() - timedelta(minutes=i * 17)}
+            for i in range(weeks * 100)
+        ])
+
+def measure(engine, params: dict, runs: int):
+    results = []
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE"))
+        for label, sql in HOT_QUERIES:
+            plan = " | ".join(row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql), params))
+            started = time.perf_counter()
+            for _ in range(runs):
+                conn.execute(text(sql), params).all()
+            results.append((label, plan, (time.perf_counter() - started) * 1000 / runs))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EXPLAIN antes/después de los índices compuestos")
+    parser.add_argument("--weeks", type=int, default=156, help="Semanas de historial (156 = 3 años)")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--runs", type=int, default=50, help="Repeticiones por consulta")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_indexes_"), "bench.sqlite")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    # Partimos del esquema previo: sin los índices nuevos
+    with engine.begin() as conn:
+        for _, name in ADDED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+    print(f"⏱️ Generando {args.weeks} semanas x {args.users} usuarios...")
+    seed(engine, args.weeks, args.users)
+    params = {"week_id": args.weeks // 2, "now": datetime.now(), "office_id": 3}
+
+    before = measure(engine, params, args.runs)
+    created = ensure_indexes(engine)
+    print(f"🛠️ Índices creados por la migración: {', '.join(created)}")
+    after = measure(engine, params, args.runs)
+
+    for (label, plan_before, ms_before), (_, plan_after, ms_after) in zip(before, after):
+        print(f"\n{label}")
+        print(f"  ANTES   {ms_before:8.3f} ms  {plan_before}")
+        print(f"  DESPUÉS {ms_after:8.3f} ms  {plan_after}")
+        if ms_after: print(f"  x{ms_before / ms_after:.1f}")
@@ -0,0 +1,154 @@
+# bench_sqlite.py
+# Mide cuántos pedidos por segundo aguanta SQLite con envíos concurrentes,
+# con la configuración por defecto (rollback journal) y con el modo rendimiento (WAL + PRAGMAs).
+# Uso: python bench_sqlite.py [--threads 8] [--orders 40] [--readers 2]
+# Trabaja sobre bases temporales: no toca data/db.sqlite.
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+from database.connection import configure_sqlite_performance, SQLITE_PRAGMAS
+from database.models import Base, User, Week, MenuItem, Order
+from services.order_service import submit_order, DAY_KEYS
+
+def _make_engine(path: str, performance: bool):
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"check_same_thread": False},
+        pool_size=32, max_overflow=0
+    )
+    if performance:
+        configure_sqlite_performance(engine)
+    return engine
+
+def _seed(Session, users: int):
+    db = Session()
+    week = Week(title="Semana Benchmark", start_date=date.today(), end_date=datetime.now() + timedelta(days=7))
+    db.add(week)
+    db.flush()
+    items = [
+        MenuItem(week_id=week.id, day=day, type=t, option_number=opt, description=f"{t} {opt}")
+        for day in DAY_KEYS for t in ("Proteína", "Guarnición", "Plato Completo") for opt in (1, 2)
+    ]
+    db.add_all(items)
+    db.add_all([User(username=f"bench{i}", full_name=f"Bench {i}", password_hash="x") for i in range(users)])
+    db.commit()
+    by_type = {}
+    for item in items:
+        by_type.setdefault((item.day, item.type), []).append(item.id)
+    user_ids = [u for (u,) in db.query(User.id).order_by(User.id).all()]
+    week_id = week.id
+    db.close()
+    return week_id, user_ids, by_type
+
+def _random_details(by_type, rnd: random.Random):
+    details = {}
+    for day in DAY_KEYS:
+        if rnd.random() < 0.5:
+            details[day] = {"tipo": "completo", "plato_id": rnd.choice(by_type[(day, "Plato Completo")]), "note": ""}
+        else:
+            details[day] = {
+                "tipo": "combinado", "note": "",
+                "proteina_id": rnd.choice(by_type[(day, "Proteína")]),
+                "guarnicion_id": rnd.choice(by_type[(day, "Guarnición")]),
+            }
+    return details
+
+def run_mode(performance: bool, threads: int, orders_per_thread: int, readers: int):
+    tmp_dir = tempfile.mkdtemp(prefix="bench_sqlite_")
+    engine = _make_engine(os.path.join(tmp_dir, "bench.sqlite"), performance)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    week_id, user_ids, by_type = _seed(Session, threads * orders_per_thread)
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+    stop_readers = threading.Event()
+    reads = [0]
+
+    def writer(worker: int):
+        rnd = random.Random(worker)
+        db = Session()
+        try:
+            for user_id in user_ids[worker::threads]:
+                # Cada usuario guarda y después edita su pedido (insert + update)
+                for _ in range(2):
+                    started = time.perf_counter()
+                    ok, msg = submit_order(db, user_id, week_id, _random_details(by_type, rnd))
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                        if not ok: errors.append(msg)
+        finally:
+            db.close()
+
+    def reader():
+        # Simula el panel de admin / reportes leyendo mientras los usuarios guardan
+        db = Session()
+        try:
+            while not stop_readers.is_set():
+                db.query(func.count(Order.id)).filter(Order.week_id == week_id).scalar()
+                db.query(Order.details).filter(Order.week_id == week_id).all()
+                db.rollback()
+                with lock: reads[0] += 1
+        finally:
+            db.close()
+
+    reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+    writer_threads = [threading.Thread(target=writer, args=(i,)) for i in range(threads)]
+    for t in reader_threads: t.start()
+    started = time.perf_counter()
+    for t in writer_threads: t.start()
+    for t in writer_threads: t.join()
+    total = time.perf_counter() - started
+    stop_readers.set()
+    for t in reader_threads: t.join()
+
+    with engine.connect() as conn:
+        journal = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+    engine.dispose()
+
+    latencies.sort()
+    return {
+        "journal": journal,
+        "submits": len(latencies),
+        "errors": len(errors),
+        "seconds": total,
+        "per_second": len(latencies) / total if total else 0.0,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0.0,
+        "reads": reads[0],
+        "sample_error": errors[0] if errors else "",
+    }
+
+def _print_result(label: str, result: dict):
+    print(f"\n{label} (journal_mode={result['journal']})")
+    print(f"  Envíos: {result['submits']}  Errores: {result['errors']}  Tiempo: {result['seconds']:.2f}s")
+    print(f"  Pedidos/s: {result['per_second']:.1f}  p50: {result['p50_ms']:.1f} ms  p95: {result['p95_ms']:.1f} ms")
+    print(f"  Lecturas concurrentes completadas: {result['reads']}")
+    if result["sample_error"]:
+        print(f"  Ejemplo de error: {result['sample_error'][:120]}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de envíos de pedidos concurrentes en SQLite")
+    parser.add_argument("--threads", type=int, default=8, help="Hilos que envían pedidos a la vez")
+    parser.add_argument("--orders", type=int, default=40, help="Usuarios por hilo (cada uno guarda y edita)")
+    parser.add_argument("--readers", type=int, default=2, help="Hilos leyendo en paralelo (reportes)")
+    args = parser.parse_args()
+
+    print(f"⏱️ {args.threads} hilos x {args.orders} usuarios, {args.readers} lectores concurrentes")
+    print(f"PRAGMAs del modo rendimiento: {SQLITE_PRAGMAS}")
+    before = run_mode(False, args.threads, args.orders, args.readers)
+    _print_result("ANTES: configuración por defecto", before)
+    after = run_mode(True, args.threads, args.orders, args.readers)
+    _print_result("DESPUÉS: modo rendimiento", after)
+
+    if before["per_second"]:
+        print(f"\n🚀 Mejora de throughput: x{after['per_second'] / before['per_second']:.2f}")
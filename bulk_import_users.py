@@ -0,0 +1,40 @@
+# bulk_import_users.py
+# Alta masiva de usuarios desde una planilla CSV o Excel (onboarding de una oficina).
+# Columnas: usuario, nombre, contraseña, oficina, rol (opcional).
+# Uso: python bulk_import_users.py usuarios.csv [--dry-run]
+
+import argparse
+import sys
+import time
+from database.connection import init_db, SessionLocal
+from services.auth import bulk_create_users
+from services.user_import import read_user_rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Alta masiva de usuarios desde CSV/XLSX")
+    parser.add_argument("file", help="Planilla .csv o .xlsx")
+    parser.add_argument("--dry-run", action="store_true", help="Solo valida: no hashea ni guarda")
+    args = parser.parse_args()
+
+    rows, read_error = read_user_rows(args.file, args.file)
+    if read_error:
+        print(f"❌ {read_error}")
+        sys.exit(1)
+
+    if not args.dry_run:
+        init_db() # Aplica las migraciones pendientes (una validación no toca el esquema)
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        created, errors = bulk_create_users(db, rows, dry_run=args.dry_run)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+
+    for error in errors:
+        print(f"  Fila {error['Fila']}: {error['Usuario'] or '-'} -> {error['Error']}")
+    if args.dry_run:
+        print(f"🔎 {len(rows)} filas leídas: {created} se crearían, {len(errors)} con error.")
+    else:
+        print(f"✅ {created} usuarios creados de {len(rows)} filas ({len(errors)} con error) en {elapsed:.1f}s.")
+    sys.exit(1 if errors else 0)
@@ -1,57 +1,518 @@
 import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
 import streamlit as st
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker
 
 # 1. Definir la URL de la base de datos de forma segura
-DATABASE_URL = ""
-
-# Intentamos leer los secretos con tu estructura original
-try:
-    # Verificamos TU estructura exacta de secretos en Streamlit Cloud
-    if "connections" in st.secrets and "database_url" in st.secrets.connections:
-        DATABASE_URL = st.secrets.connections.database_url
-        
-        # Correcciones vitales para Neon
-        if DATABASE_URL.startswith("postgres://"):
-            DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-            
-        if "sslmode" not in DATABASE_URL:
-            separator = "&" if "?" in DATABASE_URL else "?"
-            DATABASE_URL += f"{separator}sslmode=require"
-            
-        print("✅ Conectado a PostgreSQL (Nube/Neon).")
-    else:
-        raise ValueError("No se encontraron secretos de conexión [connections].")
-except Exception as e:
-    # BLOQUE FALLBACK: Si falla lo anterior, usamos SQLite local
-    DATA_DIR = "data"
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR)
-    
-    db_path = os.path.join(os.getcwd(), DATA_DIR, "db.sqlite")
-    DATABASE_URL = f"sqlite:///{db_path}"
-    print(f"⚠️ Usando SQLite local en: {DATABASE_URL}")
-
-# 2. Configurar el motor
-if "sqlite" in DATABASE_URL:
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args={"check_same_thread": False}
-    )
-else:
-    engine = create_engine(
-        DATABASE_URL, 
-        pool_pre_ping=True
-    )
-
-# 3. Sesión
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _resolve_database_url():
+    # Intentamos leer los secretos con tu estructura original
+    try:
+        # Verificamos TU estructura exacta de secretos en Streamlit Cloud
+        if "connections" in st.secrets and "database_url" in st.secrets.connections:
+            url = st.secrets.connections.database_url
 
-def init_db():
-    from database.models import Base
+            # Correcciones vitales para Neon
+            if url.startswith("postgres://"):
+                url = url.replace("postgres://", "postgresql://", 1)
+
+            if "sslmode" not in url:
+                separator = "&" if "?" in url else "?"
+                url += f"{separator}sslmode=require"
+
+            print("✅ Conectado a PostgreSQL (Nube/Neon).")
+            return url
+        else:
+            raise ValueError("No se encontraron secretos de conexión [connections].")
+    except Exception as e:
+        # BLOQUE FALLBACK: Si falla lo anterior, usamos SQLite local
+        DATA_DIR = "data"
+        if not os.path.exists(DATA_DIR):
+            os.makedirs(DATA_DIR)
+
+        db_path = os.path.join(os.getcwd(), DATA_DIR, "db.sqlite")
+        url = f"sqlite:///{db_path}"
+        print(f"⚠️ Usando SQLite local en: {url}")
+        return url
+
+# 2. Configuración del pool (variables de entorno DB_* o sección [database] de los secretos)
+POOL_DEFAULTS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_recycle": 300,   # Neon corta conexiones ociosas: reciclamos antes
+    "pool_timeout": 30,
+    "pool_prewarm": 0,     # Conexiones a abrir al arrancar (0 = ninguna)
+    "replica_max_lag_seconds": 10,  # Con más retraso que esto, las lecturas vuelven a la primaria
+    "replica_connect_timeout": 5,   # Segundos para conectar a la réplica antes de darla por caída
+    "slow_query_ms": 200,  # Sentencias más lentas que esto se registran en el log de consultas lentas
+    "query_debug": 0,      # 1 = los admins ven el pie de depuración de consultas por defecto
+}
+
+def _as_int(name: str, value, source: str):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        print(f"⚠️ Valor inválido para {name} en {source} ({value!r}): se usa {POOL_DEFAULTS[name]}.")
+        return POOL_DEFAULTS[name]
+
+def _pool_setting(name: str):
+    env_value = os.environ.get(f"DB_{name.upper()}")
+    if env_value is not None:
+        return _as_int(name, env_value, f"DB_{name.upper()}")
+    try:
+        if "database" in st.secrets and name in st.secrets.database:
+            value = st.secrets.database[name]
+        else:
+            return POOL_DEFAULTS[name]
+    except Exception:
+        return POOL_DEFAULTS[name]
+    return _as_int(name, value, f"[database] {name}")
+
+# --- MÉTRICAS DEL POOL ---
+# Límites superiores (ms) de los baldes del histograma de espera al pedir una conexión
+CHECKOUT_BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000, 5000]
+
+class PoolStats:
+    """Contadores de checkout del pool (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.total_wait_ms = 0.0
+            self.max_wait_ms = 0.0
+            self.histogram = [0] * (len(CHECKOUT_BUCKETS_MS) + 1)
+
+    def record(self, wait_ms: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            for i, limit in enumerate(CHECKOUT_BUCKETS_MS):
+                if wait_ms <= limit:
+                    self.histogram[i] += 1
+                    break
+            else:
+                self.histogram[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            labels = [f"≤{b}ms" for b in CHECKOUT_BUCKETS_MS] + [f">{CHECKOUT_BUCKETS_MS[-1]}ms"]
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": self.total_wait_ms / self.checkouts if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait_ms,
+                "histogram": dict(zip(labels, self.histogram)),
+            }
+
+pool_stats = PoolStats()
+
+class TimedQueuePool(QueuePool):
+    """QueuePool que mide cuánto tarda cada checkout (espera por el pool + conexión nueva)."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record((time.perf_counter() - started) * 1000, timed_out=True)
+            raise
+        pool_stats.record((time.perf_counter() - started) * 1000)
+        return conn
+
+# --- MODO RENDIMIENTO SQLITE (DESPLIEGUE LOCAL / FALLBACK) ---
+# WAL: los lectores no bloquean al que escribe y los commits no reescriben el archivo entero.
+# Desactivable con DB_SQLITE_PERFORMANCE=0 (ej. si la base vive en un disco de red, donde WAL no es seguro).
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",    # Con WAL es seguro ante caídas del proceso; solo se arriesga el último commit si se corta la luz
+    "busy_timeout": 5000,       # ms esperando el lock de escritura antes de dar "database is locked"
+    "mmap_size": 268435456,     # 256 MB de lecturas mapeadas en memoria
+    "cache_size": -65536,       # Negativo = KiB -> 64 MB de caché de páginas por conexión
+}
+
+def sqlite_performance_enabled():
+    return os.environ.get("DB_SQLITE_PERFORMANCE", "1").lower() not in ("0", "false", "no", "off")
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def configure_sqlite_performance(sqlite_engine):
+    """Aplica los PRAGMAs de rendimiento en cada conexión nueva del motor SQLite."""
+    event.listen(sqlite_engine, "connect", _apply_sqlite_pragmas)
+    return sqlite_engine
+
+# --- INSTRUMENTACIÓN DE CONSULTAS (POR RERUN Y POR PÁGINA) ---
+# Cada rerun de Streamlit corre en su hilo: el alcance vive en un ContextVar, así las sentencias
+# de los trabajos en segundo plano (otros hilos) no se mezclan con las de la página.
+N_PLUS_ONE_THRESHOLD = 10  # La misma sentencia repetida tantas veces en un rerun huele a N+1
+SLOW_LOG_SIZE = 50
+_query_settings = {}  # Se leen en el primer uso, no al importar (sin tocar st.secrets)
+
+def slow_query_ms():
+    if "slow_query_ms" not in _query_settings:
+        _query_settings["slow_query_ms"] = _pool_setting("slow_query_ms")
+    return _query_settings["slow_query_ms"]
+
+def query_debug_default():
+    if "query_debug" not in _query_settings:
+        _query_settings["query_debug"] = bool(_pool_setting("query_debug"))
+    return _query_settings["query_debug"]
+
+class QueryScope:
+    """Sentencias y tiempo de BD de un rerun."""
+
+    def __init__(self, page: str):
+        self.page = page
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+        self.slow = []
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD):
+        return [(stmt, n) for stmt, n in self.statements.most_common() if n >= threshold]
+
+    def summary(self):
+        return f"{self.queries} consultas, {self.seconds:.2f}s de BD"
+
+_current_scope = ContextVar("query_scope", default=None)
+_page_stats_lock = threading.Lock()
+page_stats = {}  # página -> {"reruns", "queries", "seconds", "max_queries"}
+slow_queries = deque(maxlen=SLOW_LOG_SIZE)
+
+def _parameters_shape(parameters, executemany: bool = False):
+    """Forma de los parámetros (nombres y tipos, sin valores) para el log de consultas lentas."""
+    if executemany and parameters:
+        return f"{len(parameters)} x {_parameters_shape(parameters[0])}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(v).__name__ for v in parameters) + ")"
+    return type(parameters).__name__
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None: return
+    elapsed = time.perf_counter() - started
+
+    scope = _current_scope.get()
+    if scope is not None:
+        scope.queries += 1
+        scope.seconds += elapsed
+        scope.statements[statement] += 1
+
+    if elapsed * 1000 >= slow_query_ms():
+        entry = {
+            "page": scope.page if scope else "(fuera de página)",
+            "ms": round(elapsed * 1000, 1),
+            "statement": " ".join(statement.split())[:500],
+            "params": _parameters_shape(parameters, executemany),
+        }
+        slow_queries.append(entry)
+        if scope is not None: scope.slow.append(entry)
+        print(f"🐢 Consulta lenta ({entry['ms']} ms) [{entry['page']}]: {entry['statement']} | params: {entry['params']}")
+
+def instrument_engine(target_engine):
+    """Engancha el conteo de sentencias y el log de consultas lentas al motor."""
+    event.listen(target_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(target_engine, "after_cursor_execute", _after_cursor_execute)
+    return target_engine
+
+@contextmanager
+def query_scope(page: str):
+    """Agrupa las sentencias emitidas desde este hilo; al salir suma el rerun a las estadísticas de la página."""
+    scope = QueryScope(page)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+        with _page_stats_lock:
+            stats = page_stats.setdefault(scope.page, {"reruns": 0, "queries": 0, "seconds": 0.0, "max_queries": 0})
+            stats["reruns"] += 1
+            stats["queries"] += scope.queries
+            stats["seconds"] += scope.seconds
+            stats["max_queries"] = max(stats["max_queries"], scope.queries)
+
+@contextmanager
+def count_queries():
+    """
+    Sub-alcance para medir una operación (ej. una exportación) dentro del rerun actual.
+    Al salir, sus sentencias se suman al alcance de la página, que las sigue viendo.
+    """
+    parent = _current_scope.get()
+    scope = QueryScope(parent.page if parent else "(fuera de página)")
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+        if parent is not None:
+            parent.queries += scope.queries
+            parent.seconds += scope.seconds
+            parent.statements.update(scope.statements)
+            parent.slow.extend(scope.slow)
+
+def get_page_stats():
+    """Promedios por página (para el pie de depuración del admin)."""
+    with _page_stats_lock:
+        return [
+            {
+                "Página": page,
+                "Reruns": stats["reruns"],
+                "Consultas/rerun": round(stats["queries"] / stats["reruns"], 1),
+                "Máx. consultas": stats["max_queries"],
+                "ms BD/rerun": round(stats["seconds"] * 1000 / stats["reruns"], 1),
+            }
+            for page, stats in sorted(page_stats.items())
+        ]
+
+# 3. Motor único por proceso
+_engine = None
+_engine_pool_options = {}  # Lo que get_engine le pasó al pool (para reportarlo sin leer atributos privados)
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """Crea (una sola vez por proceso) y devuelve el motor compartido."""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            return _engine
+
+        url = _resolve_database_url()
+        pool_options = {
+            "poolclass": TimedQueuePool,
+            "pool_size": _pool_setting("pool_size"),
+            "max_overflow": _pool_setting("max_overflow"),
+            "pool_recycle": _pool_setting("pool_recycle"),
+            "pool_timeout": _pool_setting("pool_timeout"),
+        }
+        _engine_pool_options.update(pool_options)
+        if "sqlite" in url:
+            _engine = create_engine(
+                url,
+                connect_args={"check_same_thread": False},
+                **pool_options
+            )
+            if sqlite_performance_enabled():
+                configure_sqlite_performance(_engine)
+        else:
+            _engine = create_engine(
+                url,
+                pool_pre_ping=True,
+                **pool_options
+            )
+        instrument_engine(_engine)
+        return _engine
+
+def prewarm_pool(count: int = None):
+    """Abre N conexiones a la vez y las devuelve al pool, para no pagar la latencia en el primer pedido."""
+    count = _pool_setting("pool_prewarm") if count is None else count
+    engine = get_engine()
+    count = min(count, engine.pool.size())
+    if count <= 0: return 0
+    connections = []
     try:
-        Base.metadata.create_all(bind=engine)
-        print("✅ Base de datos inicializada correctamente.")
+        for _ in range(count):
+            connections.append(engine.connect())
+    finally:
+        for conn in connections:
+            conn.close()
+    return len(connections)
+
+def get_pool_status():
+    """Estado actual del pool + métricas acumuladas de checkout (para el panel de admin)."""
+    pool = get_engine().pool
+    status = {
+        "pool_size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": _engine_pool_options["max_overflow"],
+    }
+    status.update(pool_stats.snapshot())
+    return status
+
+# 4. Sesión (el motor se resuelve al abrir la primera sesión, no al importar)
+class _LazySessionMaker(sessionmaker):
+    def __call__(self, **local_kw):
+        if "bind" not in local_kw and self.kw.get("bind") is None:
+            local_kw["bind"] = get_engine()
+        return super().__call__(**local_kw)
+
+SessionLocal = _LazySessionMaker(autocommit=False, autoflush=False)
+
+# 5. Réplica de solo lectura (opcional): reportes, exportaciones y auditoría
+# Se configura con [connections] replica_url en los secretos o la variable DATABASE_REPLICA_URL.
+REPLICA_CHECK_INTERVAL = 5  # Segundos entre mediciones del retraso de la réplica
+
+_REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+def _resolve_replica_url():
+    url = os.environ.get("DATABASE_REPLICA_URL")
+    if not url:
+        try:
+            if "connections" in st.secrets and "replica_url" in st.secrets.connections:
+                url = st.secrets.connections.replica_url
+        except Exception:
+            url = None
+    if not url: return None
+
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    if url.startswith("postgresql") and "sslmode" not in url:
+        separator = "&" if "?" in url else "?"
+        url += f"{separator}sslmode=require"
+    return url
+
+_replica_engine = None
+_replica_lock = threading.Lock()
+_replica_state = {"configured": None, "usable": None, "lag_seconds": None, "checked_at": 0.0, "error": None}
+
+def get_replica_engine():
+    """Motor de la réplica (uno por proceso) o None si no hay réplica configurada."""
+    global _replica_engine
+    with _replica_lock:
+        if _replica_state["configured"] is None:
+            url = _resolve_replica_url()
+            _replica_state["configured"] = url is not None
+            if url:
+                # Sin tope, una réplica que no responde cuelga el rerun hasta el timeout TCP del sistema
+                connect_args = {"connect_timeout": _pool_setting("replica_connect_timeout")} if url.startswith("postgresql") else {}
+                try:
+                    _replica_engine = create_engine(
+                        url,
+                        connect_args=connect_args,
+                        pool_pre_ping=True,
+                        pool_size=_pool_setting("pool_size"),
+                        max_overflow=_pool_setting("max_overflow"),
+                        pool_recycle=_pool_setting("pool_recycle"),
+                        pool_timeout=_pool_setting("pool_timeout"),
+                    )
+                    instrument_engine(_replica_engine)
+                    print("✅ Réplica de lectura configurada.")
+                except Exception as e:
+                    _replica_state["configured"] = False
+                    print(f"⚠️ No se pudo crear el motor de la réplica, se usa solo la primaria: {e}")
+        return _replica_engine
+
+def _measure_replica_lag():
+    replica = get_replica_engine()
+    with replica.connect() as conn:
+        if replica.dialect.name != "postgresql":
+            conn.execute(text("SELECT 1"))  # Sin replicación nativa que medir: solo verificamos que responda
+            return 0.0
+        return float(conn.execute(text(_REPLICA_LAG_SQL)).scalar() or 0)
+
+def replica_is_usable():
+    """True si la réplica existe, responde y su retraso está por debajo del umbral (medido cada pocos segundos)."""
+    if get_replica_engine() is None: return False
+    now = time.monotonic()
+    with _replica_lock:
+        if now - _replica_state["checked_at"] < REPLICA_CHECK_INTERVAL:
+            return bool(_replica_state["usable"])
+        _replica_state["checked_at"] = now  # Un solo hilo mide; los demás usan el último resultado
+
+    try:
+        lag, error = _measure_replica_lag(), None
     except Exception as e:
-        print(f"❌ Error al inicializar la BD: {e}")
\ No newline at end of file
+        lag, error = None, str(e)
+
+    usable = lag is not None and lag <= _pool_setting("replica_max_lag_seconds")
+    with _replica_lock:
+        if usable != _replica_state["usable"]:
+            print("✅ Lecturas enviadas a la réplica." if usable else f"⚠️ Réplica no disponible o atrasada (lag={lag}): leyendo de la primaria.")
+        _replica_state.update(usable=usable, lag_seconds=lag, error=error)
+    return usable
+
+def get_replica_status():
+    """Estado de la réplica para el panel de admin."""
+    configured = get_replica_engine() is not None
+    usable = replica_is_usable() if configured else False
+    with _replica_lock:
+        return {
+            "configured": configured,
+            "usable": usable,
+            "lag_seconds": _replica_state["lag_seconds"],
+            "max_lag_seconds": _pool_setting("replica_max_lag_seconds"),
+            "error": _replica_state["error"],
+        }
+
+def _reject_writes(session, flush_context, instances):
+    raise RuntimeError("Sesión de solo lectura: las escrituras van por SessionLocal.")
+
+def ReadSessionLocal():
+    """
+    Sesión para lecturas pesadas. Usa la réplica si está disponible y al día;
+    si no, la primaria. En ambos casos la sesión rechaza escrituras del ORM.
+    """
+    bind = _replica_engine if replica_is_usable() else get_engine()
+    session = SessionLocal(bind=bind)
+    session.info["read_only"] = True
+    session.info["replica"] = bind is _replica_engine  # Puede ir atrasada: no alimenta cachés compartidas
+    event.listen(session, "before_flush", _reject_writes)
+    return session
+
+@contextmanager
+def read_session(db=None):
+    """Usa la sesión recibida o abre (y cierra) una de solo lectura."""
+    if db is not None:
+        yield db
+        return
+    session = ReadSessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+_init_lock = threading.Lock()
+_initialized = False
+
+def init_db():
+    """
+    Lleva el esquema a la última versión (ver database/migrations.py) y precalienta el pool.
+    Una sola vez por proceso: Streamlit vuelve a ejecutar app.py en cada rerun y no queremos
+    la consulta de versión ni el precalentado en cada clic. Si falla, el próximo rerun reintenta.
+    """
+    global _initialized
+    from database.migrations import run_migrations
+    with _init_lock:
+        if _initialized: return
+        try:
+            for version, description in run_migrations(get_engine()):
+                print(f"🛠️ Migración {version:03d} aplicada: {description}")
+            warmed = prewarm_pool()
+            if warmed: print(f"🔥 Pool precalentado con {warmed} conexiones.")
+            _initialized = True
+            print("✅ Base de datos inicializada correctamente.")
+        except Exception as e:
+            print(f"❌ Error al inicializar la BD: {e}")
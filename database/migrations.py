@@ -0,0 +1,216 @@
+# database/migrations.py
+import datetime
+import sqlite3
+import time
+from contextlib import contextmanager
+from sqlalchemy import inspect, text, Table, Column, Integer, String, DateTime, MetaData, select, func, insert
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+
+# --- TABLA DE VERSIÓN DEL ESQUEMA ---
+# Fuera de Base a propósito: la maneja solo el runner, antes de que exista cualquier otra tabla.
+_version_metadata = MetaData()
+schema_version = Table(
+    "schema_version", _version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, default=datetime.datetime.utcnow),
+)
+
+# Clave del advisory lock de Postgres: un solo proceso migra a la vez
+MIGRATION_LOCK_ID = 7102
+# Quien espera consulta pg_try_advisory_lock cada tanto en vez de quedarse en pg_advisory_lock:
+# una sentencia bloqueada mantiene su snapshot abierto, y CREATE INDEX CONCURRENTLY (paso 4, en
+# otra conexión del proceso que migra) espera a todos los snapshots viejos -> deadlock invisible.
+MIGRATION_LOCK_POLL = 0.5     # Segundos entre intentos
+MIGRATION_LOCK_TIMEOUT = 600  # Segundos esperando a que otro proceso termine de migrar
+# SQLite no tiene advisory locks: se toma el lock de escritura (BEGIN IMMEDIATE) de un archivo
+# hermano de la base, así los pasos siguen pudiendo escribir en la base por sus propias conexiones.
+SQLITE_LOCK_SUFFIX = ".migrate-lock"
+SQLITE_LOCK_TIMEOUT = 600  # Segundos esperando a que otro proceso termine de migrar
+
+# --- PASO 2: COLUMNAS NUEVAS EN TABLAS EXISTENTES ---
+# create_all no modifica tablas existentes, así que las agregamos con ALTER TABLE.
+ADDED_COLUMNS = [
+    ("weeks", "data_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("export_logs", "office_id", "INTEGER"),
+    ("export_logs", "cache_key", "VARCHAR"),
+    ("export_logs", "cache_hit", "BOOLEAN DEFAULT FALSE"),
+    ("export_logs", "job_kind", "VARCHAR"),
+    ("export_logs", "status", "VARCHAR DEFAULT 'done'"),
+    ("export_logs", "started_at", "TIMESTAMP"),
+    ("export_logs", "finished_at", "TIMESTAMP"),
+    ("export_logs", "duration_ms", "INTEGER"),
+    ("export_logs", "message", "TEXT"),
+    ("orders", "version", "INTEGER NOT NULL DEFAULT 1"),
+]
+
+def ensure_added_columns(engine, columns=ADDED_COLUMNS):
+    """Agrega (si faltan) las columnas nuevas a bases de datos ya existentes."""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with engine.begin() as conn:
+        for table, column, ddl in columns:
+            if table not in existing_tables: continue
+            existing_columns = {c["name"] for c in inspector.get_columns(table)}
+            if column in existing_columns: continue
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            added.append(f"{table}.{column}")
+    return added
+
+# --- PASO 4: ÍNDICES COMPUESTOS ---
+# Índices declarados en los modelos después de la creación original de las tablas.
+ADDED_INDEXES = [
+    ("orders", "ix_orders_week_id"),
+    ("menu_items", "ix_menu_items_week_day_type_option"),
+    ("weeks", "ix_weeks_open_end_date"),
+    ("users", "ix_users_active_office"),
+    ("audit_logs", "ix_audit_logs_timestamp_desc"),
+]
+
+def _model_index(table: str, name: str):
+    from database.models import Base
+    return next(ix for ix in Base.metadata.tables[table].indexes if ix.name == name)
+
+def _invalid_postgres_indexes(conn):
+    # Un CREATE INDEX CONCURRENTLY interrumpido deja el índice marcado como inválido
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+    )).all()
+    return {name for (name,) in rows}
+
+def ensure_indexes(engine):
+    """
+    Crea (si faltan) los índices nuevos en bases existentes.
+    En Postgres se usa CREATE INDEX CONCURRENTLY: no bloquea los pedidos mientras se construye.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    is_postgres = engine.dialect.name == "postgresql"
+    created = []
+
+    # CONCURRENTLY no puede correr dentro de una transacción
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        invalid = _invalid_postgres_indexes(conn) if is_postgres else set()
+        for table, name in ADDED_INDEXES:
+            if table not in existing_tables: continue
+            existing = {ix["name"] for ix in inspector.get_indexes(table)}
+            if name in existing and name not in invalid: continue
+
+            if name in invalid:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            ddl = str(CreateIndex(_model_index(table, name)).compile(dialect=engine.dialect))
+            if is_postgres:
+                ddl = ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+            conn.execute(text(ddl))
+            created.append(name)
+    return created
+
+# --- PASO 5: REVOCACIÓN DE SESIONES ---
+SESSION_COLUMNS = [
+    ("users", "session_epoch", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+def _add_session_columns(engine):
+    ensure_added_columns(engine, SESSION_COLUMNS)
+
+# --- PASO 6: LATIDO DE TRABAJOS EN SEGUNDO PLANO ---
+JOB_HEARTBEAT_COLUMNS = [
+    ("export_logs", "heartbeat_at", "TIMESTAMP"),
+]
+
+def _add_job_heartbeat_columns(engine):
+    ensure_added_columns(engine, JOB_HEARTBEAT_COLUMNS)
+
+# --- PASOS ---
+# Cada paso es idempotente (puede volver a correr si el proceso se cortó a mitad de camino)
+# y recibe el motor. Para cambiar el esquema: agregar un paso AL FINAL con el número siguiente;
+# nunca editar ni reordenar pasos ya publicados.
+def _create_tables(engine):
+    from database.models import Base
+    Base.metadata.create_all(bind=engine)  # checkfirst: solo crea las tablas que faltan
+
+def _backfill_order_lines(engine):
+    # order_lines recién creada en una base con pedidos: la completamos desde el JSON
+    from database.models import Order, OrderLine
+    from services.order_service import backfill_order_lines
+    db = Session(bind=engine)
+    try:
+        if db.query(Order.id).first() and not db.query(OrderLine.id).first():
+            count = backfill_order_lines(db)
+            print(f"🛠️ order_lines generadas para {count} pedidos.")
+    finally:
+        db.close()
+
+MIGRATIONS = [
+    (1, "Tablas base (create_all de las que falten)", _create_tables),
+    (2, "Columnas de caché/trabajos de exportación y versión de pedidos", ensure_added_columns),
+    (3, "Backfill de order_lines desde Order.details", _backfill_order_lines),
+    (4, "Índices compuestos para las consultas frecuentes", ensure_indexes),
+    (5, "Época de sesiones por usuario (tokens firmados)", _add_session_columns),
+    (6, "Latido de trabajos de exportación", _add_job_heartbeat_columns),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# --- RUNNER ---
+def get_schema_version(engine):
+    """Versión aplicada del esquema (0 si la tabla schema_version todavía no existe)."""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        return 0
+
+@contextmanager
+def _migration_lock(engine):
+    """Serializa las migraciones entre procesos (app, scripts de CLI) que arrancan a la vez."""
+    if engine.dialect.name == "postgresql":
+        # El lock vive en su propia conexión: los pasos usan otras (ej. índices en AUTOCOMMIT)
+        with engine.connect() as lock_conn:
+            deadline = time.monotonic() + MIGRATION_LOCK_TIMEOUT
+            while True:
+                got_lock = lock_conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": MIGRATION_LOCK_ID}).scalar()
+                lock_conn.commit()  # Entre intentos la conexión queda sin transacción (sin snapshot)
+                if got_lock: break
+                if time.monotonic() > deadline:
+                    raise TimeoutError("Otro proceso sigue migrando la base; se agotó la espera.")
+                time.sleep(MIGRATION_LOCK_POLL)
+            try:
+                yield
+            finally:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_ID})
+                lock_conn.commit()
+        return
+
+    database = engine.url.database
+    if engine.dialect.name != "sqlite" or not database or database == ":memory:":
+        yield  # Base en memoria: es de este proceso, no hay con quién competir
+        return
+    lock_conn = sqlite3.connect(database + SQLITE_LOCK_SUFFIX, timeout=SQLITE_LOCK_TIMEOUT, isolation_level=None)
+    try:
+        lock_conn.execute("BEGIN IMMEDIATE")
+        yield
+    finally:
+        lock_conn.close()  # Cerrar sin commit libera el lock
+
+def run_migrations(engine):
+    """
+    Aplica en orden los pasos pendientes y devuelve [(versión, descripción)] de los aplicados.
+    Si la base ya está al día solo cuesta una consulta.
+    """
+    if get_schema_version(engine) >= LATEST_VERSION:
+        return []
+
+    with _migration_lock(engine):
+        _version_metadata.create_all(bind=engine)
+        current = get_schema_version(engine)  # Otro proceso pudo migrar mientras esperábamos
+        applied = []
+        for version, description, step in MIGRATIONS:
+            if version <= current: continue
+            step(engine)
+            with engine.begin() as conn:
+                conn.execute(insert(schema_version).values(version=version, description=description))
+            applied.append((version, description))
+        return applied
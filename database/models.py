@@ -1,6 +1,6 @@
 # database/models.py
 import datetime
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, JSON, UniqueConstraint, Date
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, JSON, UniqueConstraint, Date, Index
 from sqlalchemy.orm import relationship, declarative_base
 
 Base = declarative_base()
@@ -25,12 +25,20 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
+    # Sube al desactivar al usuario o resetear su contraseña: invalida sus tokens de sesión
+    session_epoch = Column(Integer, nullable=False, default=0)
+
     # Vinculación con Oficina
     office_id = Column(Integer, ForeignKey("offices.id"), nullable=True)
     office = relationship("Office", back_populates="users")
 
     orders = relationship("Order", back_populates="user")
 
+    __table_args__ = (
+        # Listados de usuarios activos (por oficina): reportes, cierre de semana
+        Index("ix_users_active_office", "is_active", "office_id"),
+    )
+
 # --- SEMANAS ---
 class Week(Base):
     __tablename__ = "weeks"
@@ -48,11 +56,20 @@ class Week(Base):
     # Lista de días cerrados (Feriados) (ej: ["thursday", "friday"])
     closed_days = Column(JSON, default=[]) 
 
+    # Contador que sube con cada cambio del admin (menú/feriados/cierre) que invalida la caché de exportación.
+    # Los pedidos no lo tocan: su cambio se detecta por la versión de cada pedido (week_data_fingerprint)
+    data_version = Column(Integer, nullable=False, default=0)
+
     # Relaciones
     menu_items = relationship("MenuItem", back_populates="week", cascade="all, delete-orphan")
     orders = relationship("Order", back_populates="week")
     export_logs = relationship("ExportLog", back_populates="week")
 
+    __table_args__ = (
+        # Semana abierta vigente (cada carga de página) y cierre automático por horario
+        Index("ix_weeks_open_end_date", "is_open", "end_date"),
+    )
+
 # --- ITEMS DEL MENÚ ---
 class MenuItem(Base):
     __tablename__ = "menu_items"
@@ -65,6 +82,11 @@ class MenuItem(Base):
     
     option_number = Column(Integer, default=1)
     description = Column(String, nullable=False)
+
+    __table_args__ = (
+        # El menú se lee siempre por semana, día y tipo, ordenado por opción
+        Index("ix_menu_items_week_day_type_option", "week_id", "day", "type", "option_number"),
+    )
     
     week = relationship("Week", back_populates="menu_items")
 
@@ -82,12 +104,38 @@ class Order(Base):
     notes = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
+    # Control de concurrencia optimista: cada escritura sube la versión y
+    # un guardado con versión vieja se rechaza (otra pestaña o un admin lo cambió)
+    version = Column(Integer, nullable=False, default=1)
+
     __table_args__ = (
         UniqueConstraint('user_id', 'week_id', name='unique_order_per_week'),
+        # La restricción única empieza por user_id: no sirve para "todos los pedidos de la semana"
+        Index("ix_orders_week_id", "week_id"),
     )
+    __mapper_args__ = {"version_id_col": version}
 
     week = relationship("Week", back_populates="orders")
     user = relationship("User", back_populates="orders")
+    lines = relationship("OrderLine", back_populates="order", cascade="all, delete-orphan")
+
+# --- LÍNEAS DE PEDIDO (NORMALIZADAS) ---
+# Una fila por plato elegido (día + tipo + plato), escrita junto con Order.details
+# para poder contar y filtrar en SQL con índices en vez de recorrer el JSON.
+class OrderLine(Base):
+    __tablename__ = "order_lines"
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
+    week_id = Column(Integer, ForeignKey("weeks.id"), nullable=False)
+    day = Column(String, nullable=False)
+    kind = Column(String, nullable=False)  # 'Plato Completo', 'Proteína' o 'Guarnición' (igual que MenuItem.type)
+    menu_item_id = Column(Integer, nullable=False)  # Sin FK: el plato puede borrarse y el pedido queda
+
+    __table_args__ = (
+        Index("ix_order_lines_week_day_item", "week_id", "day", "menu_item_id"),
+    )
+
+    order = relationship("Order", back_populates="lines")
 
 # --- LOGS DE AUDITORÍA ---
 class AuditLog(Base):
@@ -101,6 +149,11 @@ class AuditLog(Base):
     new_value = Column(Text, nullable=True)
     details = Column(Text, nullable=True)
 
+    __table_args__ = (
+        # La página de auditoría muestra los últimos N registros
+        Index("ix_audit_logs_timestamp_desc", timestamp.desc()),
+    )
+
 # --- LOGS DE EXPORTACIÓN ---
 class ExportLog(Base):
     __tablename__ = "export_logs"
@@ -110,4 +163,18 @@ class ExportLog(Base):
     filename = Column(String, nullable=False)
     created_by = Column(String, nullable=True)
 
+    # Caché de exportación: clave (semana, oficina, versión de datos) y si fue acierto
+    office_id = Column(Integer, nullable=True)
+    cache_key = Column(String, nullable=True)
+    cache_hit = Column(Boolean, default=False)
+
+    # Trabajo en segundo plano: tipo ('export', 'bundle', 'finalize'), estado y duración
+    job_kind = Column(String, nullable=True)
+    status = Column(String, default="done")  # queued | running | done | failed
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # Lo renueva el proceso dueño mientras el trabajo sigue vivo
+    finished_at = Column(DateTime, nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+    message = Column(Text, nullable=True)
+
     week = relationship("Week", back_populates="export_logs")
\ No newline at end of file
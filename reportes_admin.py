@@ -1,10 +1,13 @@
 import streamlit as st
 import pandas as pd
 from sqlalchemy.orm import Session
-from database.connection import SessionLocal
+from database.connection import SessionLocal, ReadSessionLocal, query_scope
 # Importamos modelos
-from database.models import User, Order, Week, Office
+from database.models import User, Order, OrderLine, Week, Office
 from services.admin_service import get_now_utc3
+from services.cache import get_open_week
+from services.export_service import parse_details
+from services import login_throttle
 
 # --- IMPORTACIÓN DIRECTA DE SEGURIDAD ---
 from passlib.context import CryptContext
@@ -37,22 +40,40 @@ def check_login_safe(username, password):
     if username == "soporte" and password == "Soporte2025":
         return True, "Soporte Técnico"
 
-    # --- 2. VERIFICACIÓN DB ---
+    # --- 2. LÍMITE DE INTENTOS (antes de gastar un bcrypt) ---
+    client = login_throttle.client_key()
+    allowed, wait = login_throttle.acquire(username, client)
+    if not allowed:
+        return False, f"Demasiados intentos. Espere {wait:.0f} segundos."
+
+    # Usuario inexistente: mismo costo que una contraseña incorrecta
+    if login_throttle.is_unknown_user(username):
+        login_throttle.record_failure()
+        login_throttle.dummy_check(password, verify_password_hybrid)
+        return False, "Usuario no encontrado en DB."
+
+    # --- 3. VERIFICACIÓN DB ---
     db = SessionLocal()
     try:
         user = db.query(User).filter(User.username == username).first()
         
         if not user:
+            login_throttle.remember_unknown_user(username)
+            login_throttle.record_failure()
+            login_throttle.dummy_check(password, verify_password_hybrid)
             return False, "Usuario no encontrado en DB."
         
         is_correct = verify_password_hybrid(password, user.password_hash)
         
         if not is_correct:
+            login_throttle.record_failure()
             return False, "Contraseña incorrecta."
 
         if user.role != 'admin':
+            login_throttle.record_failure()
             return False, "No tienes permisos de administrador."
-            
+        
+        login_throttle.record_success(username)
         return True, user.full_name
         
     except Exception as e:
@@ -97,12 +118,13 @@ def show_dashboard():
             st.rerun()
     st.markdown("---")
     
-    db = SessionLocal()
+    # Solo lecturas: va a la réplica si está disponible (no compite con los pedidos en la primaria)
+    db = ReadSessionLocal()
     try:
         now = get_now_utc3()
         
         # 1. SEMANAS
-        active_week = db.query(Week).filter(Week.is_open == True, Week.end_date > now).first()
+        active_week = get_open_week(db, now)
         all_weeks = db.query(Week).order_by(Week.start_date.desc()).all()
         
         if not all_weeks:
@@ -126,17 +148,24 @@ def show_dashboard():
             # Recuperamos el objeto semana COMPLETO (con sus feriados)
             selected_week_obj = db.query(Week).filter(Week.id == sel_week_id).first()
 
-        # 2. DATA (Incluye Admins)
-        users = db.query(User).filter(User.is_active == True).all()
+        # 2. DATA (Incluye Admins) - usuarios con su oficina en una sola consulta
+        users = db.query(User.id, User.full_name, User.username, Office.name).outerjoin(
+            Office, User.office_id == Office.id
+        ).filter(User.is_active == True).all()
+        
+        order_status = dict(db.query(Order.user_id, Order.status).filter(Order.week_id == sel_week_id).all())
+        users_with_order = set(order_status)
         
-        orders = db.query(Order).filter(Order.week_id == sel_week_id).all()
-        orders_map = {o.user_id: o.details for o in orders}
+        # Días con al menos un plato pedido, por usuario (consulta indexada sobre order_lines)
+        days_with_lines = {}
+        line_rows = db.query(Order.user_id, OrderLine.day).join(
+            OrderLine, OrderLine.order_id == Order.id
+        ).filter(OrderLine.week_id == sel_week_id).distinct().all()
+        for user_id, day in line_rows:
+            days_with_lines.setdefault(user_id, set()).add(day)
 
         # 3. FILTRO OFICINA
-        unique_offices = set()
-        for u in users:
-            if u.office: unique_offices.add(u.office.name)
-            else: unique_offices.add("Sin Oficina")
+        unique_offices = {office_name if office_name else "Sin Oficina" for _, _, _, office_name in users}
         
         office_list = sorted(list(unique_offices))
         office_list.insert(0, "Todas las Oficinas")
@@ -151,28 +180,43 @@ def show_dashboard():
         
         # Leemos los días cerrados de la base de datos
         closed_days_list = selected_week_obj.closed_days if selected_week_obj and selected_week_obj.closed_days else []
-
-        for user in users:
-            u_office = user.office.name if user.office else "Sin Oficina"
+        open_days = [d for d in days_map if d not in closed_days_list]
+
+        # Un día cuenta como pedido si su 'tipo' no es "nada", aunque el plato no tenga un ID válido
+        # (y por eso no tenga línea). Solo para los pedidos con días sin línea miramos el JSON;
+        # los fantasmas ('no_pedido') son "nada" todos los días.
+        to_check = [
+            user_id for user_id, status in order_status.items()
+            if status != "no_pedido" and any(d not in days_with_lines.get(user_id, ()) for d in open_days)
+        ]
+        if to_check:
+            for user_id, details in db.query(Order.user_id, Order.details).filter(
+                Order.week_id == sel_week_id, Order.user_id.in_(to_check)
+            ).all():
+                details = parse_details(details)
+                days_with_lines.setdefault(user_id, set()).update(
+                    d for d in open_days if details.get(d, {}).get("tipo", "nada") != "nada"
+                )
+
+        for user_id, full_name, username, office_name in users:
+            u_office = office_name if office_name else "Sin Oficina"
             if sel_office != "Todas las Oficinas" and u_office != sel_office: continue
 
-            if user.id not in orders_map:
-                list_no_order.append({"Nombre": user.full_name, "Usuario": user.username, "Oficina": u_office})
+            if user_id not in users_with_order:
+                list_no_order.append({"Nombre": full_name, "Usuario": username, "Oficina": u_office})
             else:
-                details = orders_map[user.id]
+                ordered_days = days_with_lines.get(user_id, set())
                 missing_days = []
                 for key_day, label_day in days_map.items():
                     # Si el día está cerrado (ej: 'thursday'), lo saltamos
                     if key_day in closed_days_list: continue
                     
-                    # NUEVA LÓGICA: Extraemos el pedido de ese día y vemos si tiene datos
-                    day_order = details.get(key_day, {})
-                    # Si el tipo es "nada", significa que no eligió opciones
-                    if day_order.get("tipo", "nada") == "nada": 
+                    # Sin plato ese día = eligió "nada"
+                    if key_day not in ordered_days: 
                         missing_days.append(label_day)
                         
                 if missing_days: 
-                    list_incomplete.append({"Nombre": user.full_name, "Oficina": u_office, "Días Faltantes": ", ".join(missing_days)})
+                    list_incomplete.append({"Nombre": full_name, "Oficina": u_office, "Días Faltantes": ", ".join(missing_days)})
 
         # 5. MOSTRAR RESULTADOS
         st.divider()
@@ -193,6 +237,8 @@ def show_dashboard():
 
 if __name__ == "__main__":
     if not st.session_state.admin_logged_in:
-        show_login_screen()
+        with query_scope("reportes/login"):
+            show_login_screen()
     else:
-        show_dashboard()
\ No newline at end of file
+        with query_scope("reportes/dashboard"):
+            show_dashboard()
\ No newline at end of file
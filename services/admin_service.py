@@ -1,9 +1,23 @@
 import pandas as pd
-import json
 import os
+from collections import namedtuple
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import select, insert, literal, text, JSON
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from database.connection import read_session, count_queries
 from database.models import Week, Order, User, MenuItem, ExportLog, AuditLog, Office
+from services.export_service import (
+    build_week_rows, iter_week_rows, missing_users_query, write_rows_streaming, EXPORT_COLUMNS, DAY_KEYS,
+    write_office_bundle_xlsx, write_office_bundle_zip
+)
+from services.kitchen_service import get_kitchen_summary, KITCHEN_SHEET
+from services.scheduler import rearm_auto_close
+from services.cache import invalidate_menu, invalidate_open_week, get_offices, bump_offices
+from services.export_cache import (
+    bump_week_data_version, week_data_fingerprint, export_cache_key, find_cached_export, record_export,
+    export_file_path, staging_path, discard_file, staged_file
+)
 
 # --- UTILIDAD: HORA UTC-3 ---
 def get_now_utc3():
@@ -26,18 +40,19 @@ def create_office(db: Session, name: str):
     if db.query(Office).filter(Office.name == name).first(): return False, "La oficina ya existe."
     new_office = Office(name=name)
     db.add(new_office)
-    try: db.commit(); return True, "Oficina creada."
+    try: db.commit(); bump_offices(); return True, "Oficina creada."
     except Exception as e: db.rollback(); return False, f"Error: {e}"
 
 def get_all_offices(db: Session):
-    return db.query(Office).order_by(Office.name).all()
+    # Instantánea compartida (OfficeRef con .id y .name); se recarga cuando cambian las oficinas
+    return get_offices(db)
 
 def delete_office(db: Session, office_id: int):
     users_count = db.query(User).filter(User.office_id == office_id).count()
     if users_count > 0: return False, f"⚠️ No se puede eliminar: Hay {users_count} usuarios vinculados."
     office = db.query(Office).filter(Office.id == office_id).first()
     if office:
-        try: db.delete(office); db.commit(); return True, "Oficina eliminada."
+        try: db.delete(office); db.commit(); bump_offices(); return True, "Oficina eliminada."
         except Exception as e: db.rollback(); return False, f"Error: {e}"
     return False, "Oficina no encontrada."
 
@@ -45,8 +60,10 @@ def delete_office(db: Session, office_id: int):
 def create_menu_item(db: Session, week_id: int, day: str, type: str, option_number: int, description: str):
     new_item = MenuItem(week_id=week_id, day=day, type=type, option_number=option_number, description=description)
     db.add(new_item)
+    bump_week_data_version(db, week_id)
     try:
         db.commit()
+        invalidate_menu(week_id)
         return True, "Plato agregado exitosamente."
     except Exception as e:
         db.rollback()
@@ -56,13 +73,15 @@ def update_menu_item(db: Session, item_id: int, new_desc: str, new_opt: int):
     item = db.query(MenuItem).filter(MenuItem.id == item_id).first()
     if not item: return False, "Ítem no encontrado."
     item.description = new_desc; item.option_number = new_opt
-    try: db.commit(); return True, "Actualizado."
+    bump_week_data_version(db, item.week_id)
+    try: db.commit(); invalidate_menu(item.week_id); return True, "Actualizado."
     except: db.rollback(); return False, "Error."
 
 def delete_menu_item(db: Session, item_id: int):
     item = db.query(MenuItem).filter(MenuItem.id == item_id).first()
     if not item: return False, "No encontrado."
-    try: db.delete(item); db.commit(); return True, "Eliminado."
+    week_id = item.week_id
+    try: bump_week_data_version(db, week_id); db.delete(item); db.commit(); invalidate_menu(week_id); return True, "Eliminado."
     except: db.rollback(); return False, "Error."
 
 # --- GESTIÓN DE SEMANAS Y LOGICA DE TIEMPO ---
@@ -72,6 +91,8 @@ def create_week(db: Session, title: str, start_date, end_datetime):
     db.add(new_week)
     db.commit()
     db.refresh(new_week)
+    rearm_auto_close()
+    invalidate_open_week()
     return new_week
 
 def update_week_closed_days(db: Session, week_id: int, closed_days_list: list):
@@ -79,130 +100,286 @@ def update_week_closed_days(db: Session, week_id: int, closed_days_list: list):
     if not week: return False, "Semana no encontrada."
     try:
         week.closed_days = closed_days_list
+        bump_week_data_version(db, week_id)
         db.commit()
+        invalidate_open_week()
         return True, "Días feriados actualizados."
     except Exception as e:
         db.rollback()
         return False, f"Error: {e}"
 
-def check_and_auto_close_weeks(db: Session):
+def check_and_auto_close_weeks(db: Session, skip_week_ids=()):
+    """
+    Intenta cerrar las semanas abiertas con el plazo vencido.
+    Devuelve {week_id: FinalizeResult}; las de skip_week_ids (en espera de reintento) quedan con None.
+    """
     now_utc3 = get_now_utc3()
-    overdue_weeks = db.query(Week).filter(Week.is_open == True, Week.end_date < now_utc3).all()
-    count = 0
-    for week in overdue_weeks:
-        finalize_week_logic(db, week.id)
-        count += 1
-    return count
+    overdue_ids = [week_id for (week_id,) in db.query(Week.id).filter(Week.is_open == True, Week.end_date < now_utc3).all()]
+    results = {}
+    for week_id in overdue_ids:
+        results[week_id] = None if week_id in skip_week_ids else finalize_week_logic(db, week_id)
+    return results
 
 # --- LOGICA DE CIERRE ---
-def finalize_week_logic(db: Session, week_id: int):
+def insert_ghost_orders(db: Session, week_id: int):
+    """
+    Crea los pedidos 'no_pedido' de todos los usuarios activos sin pedido en la semana
+    con un único INSERT … SELECT (anti-join), sin cargar usuarios ni pedidos en Python.
+    Se insertan en orden de User.id: así sus Order.id siguen el mismo orden que missing_users_query
+    y una exportación posterior (ordenada por Order.id) coincide fila a fila con el archivo del cierre.
+    No hace commit. Devuelve la cantidad de filas insertadas.
+    """
+    ghost_details = {day: {"tipo": "nada"} for day in DAY_KEYS}
+
+    has_order = select(Order.id).where(Order.user_id == User.id, Order.week_id == week_id).exists()
+    missing_users = select(
+        User.id,
+        literal(week_id),
+        literal("no_pedido"),
+        literal(ghost_details, type_=JSON),
+        literal(datetime.utcnow()),
+        literal(1),
+    ).where(User.is_active == True, ~has_order).order_by(User.id)
+
+    result = db.execute(
+        insert(Order.__table__).from_select(
+            ["user_id", "week_id", "status", "details", "created_at", "version"], missing_users
+        )
+    )
+    return result.rowcount
+
+# Resultado del cierre: status es uno de los FINALIZE_* de abajo
+FinalizeResult = namedtuple("FinalizeResult", ["status", "path", "message", "ghost_count"])
+FINALIZE_DONE = "done"                 # Esta llamada cerró la semana
+FINALIZE_ALREADY_DONE = "already_done" # La semana ya estaba cerrada
+FINALIZE_IN_PROGRESS = "in_progress"   # Otro proceso/sesión la está cerrando en este momento
+FINALIZE_NOT_FOUND = "not_found"
+FINALIZE_FAILED = "failed"
+FINALIZE_MESSAGES = {
+    FINALIZE_ALREADY_DONE: "La semana ya estaba cerrada.",
+    FINALIZE_IN_PROGRESS: "El cierre de esta semana ya está en curso en otra sesión.",
+    FINALIZE_NOT_FOUND: "Semana no encontrada.",
+}
+# Espacio de nombres para los advisory locks de Postgres (clave = (namespace, week_id))
+FINALIZE_LOCK_NAMESPACE = 7101
+
+def claim_week_finalization(db: Session, week_id: int):
+    """
+    Toma el cierre de la semana para esta transacción. Postgres: advisory lock no bloqueante
+    (si otro lo tiene -> en curso). Todos los motores: UPDATE condicional is_open=True -> False,
+    que bloquea la fila (o la base en SQLite) hasta el commit, así solo un proceso gana.
+    Devuelve FINALIZE_DONE si esta sesión debe continuar con el cierre.
+    """
+    try:
+        if db.get_bind().dialect.name == "postgresql":
+            got_lock = db.execute(
+                text("SELECT pg_try_advisory_xact_lock(:ns, :week_id)"),
+                {"ns": FINALIZE_LOCK_NAMESPACE, "week_id": week_id}
+            ).scalar()
+            if not got_lock:
+                db.rollback()
+                return FINALIZE_IN_PROGRESS
+
+        claimed = db.query(Week).filter(Week.id == week_id, Week.is_open == True).update(
+            {Week.is_open: False, Week.is_finalized: True}, synchronize_session=False
+        )
+    except OperationalError:
+        # SQLite: otro escritor tiene la base tomada más allá del busy timeout
+        db.rollback()
+        return FINALIZE_IN_PROGRESS
+
+    if claimed == 1:
+        return FINALIZE_DONE
+    exists = db.query(Week.id).filter(Week.id == week_id).first()
+    db.rollback()
+    return FINALIZE_ALREADY_DONE if exists else FINALIZE_NOT_FOUND
+
+FINALIZE_BUILD_ATTEMPTS = 3  # Reintentos si los pedidos cambian mientras se arma el archivo
+
+def _build_finalize_export(db: Session, week_id: int):
+    """
+    Arma el Excel del cierre SIN escribir en la base: pedidos actuales + usuarios sin pedido como
+    'no_pedido' (lo que insert_ghost_orders va a insertar). Se escribe en un temporal: la ruta
+    final depende de la clave de caché posterior al cierre y solo se ocupa si el cierre se confirma.
+    Devuelve (temporal, título de la semana, huella, fantasmas esperados) o None si la semana ya no está abierta.
+    """
     week = db.query(Week).filter(Week.id == week_id).first()
-    if not week or not week.is_open: return None, "Error o ya cerrada."
+    if not week or not week.is_open: return None
+    fingerprint = week_data_fingerprint(db, week_id)
+    expected_ghosts = missing_users_query(db, week_id).count()
+    safe_title = _safe_week_title(week)
+    staging = staging_path(export_file_path(safe_title, "TODAS", "cierre"))
+    kitchen_df = get_kitchen_summary(db, week_id)
+    try:
+        write_rows_streaming(staging, iter_week_rows(db, week, include_missing_users=True), extra_sheets={KITCHEN_SHEET: kitchen_df})
+    except BaseException:
+        discard_file(staging)
+        raise
+    return staging, safe_title, fingerprint, expected_ghosts
 
-    active_users = db.query(User).filter(User.is_active == True).all()
-    existing_orders = db.query(Order).filter(Order.week_id == week_id).all()
-    users_with_order_ids = {o.user_id for o in existing_orders}
-    day_keys = ["monday", "tuesday", "wednesday", "thursday", "friday"]
-    
-    for user in active_users:
-        if user.id not in users_with_order_ids:
-            ghost_details = {day: {"tipo": "nada"} for day in day_keys}
-            db.add(Order(user_id=user.id, week_id=week_id, status="no_pedido", details=ghost_details))
-    
-    week.is_open = False 
-    db.commit()
-    return export_week_to_excel(db, week_id)
+def finalize_week_logic(db: Session, week_id: int, log: ExportLog = None):
+    """
+    Cierra la semana, genera los pedidos fantasma y exporta. Es idempotente y seguro entre
+    procesos: solo quien gana claim_week_finalization inserta fantasmas y registra la exportación.
+    El archivo se arma ANTES de escribir (con los fantasmas simulados): la transacción de
+    escritura solo reclama, inserta fantasmas y registra, así en SQLite el lock de escritura
+    dura milisegundos y no lo que tarda la exportación. Si los pedidos cambiaron mientras se
+    armaba el archivo (otra huella) se descarta y se vuelve a armar. El archivo queda en un
+    temporal y recién ocupa su ruta final después del commit: un cierre perdido no pisa la
+    exportación cacheada con filas simuladas.
+    El reclamo (cerrada + finalizada) y los fantasmas se confirman en el mismo commit que el
+    registro de la exportación: si algo falla (o el proceso muere) no queda nada y la semana
+    sigue abierta para reintentar.
+    Devuelve un FinalizeResult(status, path, message, ghost_count).
+    """
+    for _ in range(FINALIZE_BUILD_ATTEMPTS):
+        try:
+            with count_queries() as counter:
+                built = _build_finalize_export(db, week_id)
+        except Exception as e:
+            db.rollback()
+            return FinalizeResult(FINALIZE_FAILED, None, f"Error al cerrar: {e}", 0)
+        db.rollback()  # Cierra la lectura: la escritura empieza con una foto nueva
+
+        if built is None:
+            staging = None
+        else:
+            staging, safe_title, fingerprint, expected_ghosts = built
+
+        # El temporal solo pasa a la ruta final después del commit; en cualquier otro camino se borra
+        published = False
+        try:
+            status = claim_week_finalization(db, week_id)
+            if status != FINALIZE_DONE:
+                return FinalizeResult(status, None, FINALIZE_MESSAGES[status], 0)
+            if built is None:  # Se cerró y reabrió mientras tanto: volver a armar
+                db.rollback()
+                continue
+
+            try:
+                if week_data_fingerprint(db, week_id) != fingerprint:
+                    db.rollback()  # Llegó o cambió un pedido mientras se armaba el archivo
+                    continue
+                ghost_count = insert_ghost_orders(db, week_id)
+                if ghost_count != expected_ghosts:
+                    db.rollback()  # Cambió el padrón de usuarios activos
+                    continue
+                bump_week_data_version(db, week_id)
+                cache_key = export_cache_key(week_id, None, week_data_fingerprint(db, week_id))
+                path = export_file_path(safe_title, "TODAS", cache_key)
+                record_export(db, week_id, None, path, cache_key, cache_hit=False, log=log)  # commit
+            except Exception as e:
+                db.rollback()
+                return FinalizeResult(FINALIZE_FAILED, None, f"Error al cerrar: {e}", 0)
+            os.replace(staging, path)
+            published = True
+        finally:
+            if staging and not published:
+                discard_file(staging)
+        invalidate_open_week()
+        return FinalizeResult(FINALIZE_DONE, path, f"Exportación exitosa ({counter.summary()}) · {ghost_count} usuarios sin pedido", ghost_count)
+
+    return FinalizeResult(FINALIZE_FAILED, None, "Error al cerrar: los pedidos cambiaron mientras se armaba la exportación.", 0)
 
 # --- EXPORTACIÓN CORREGIDA ---
-def export_week_to_excel(db: Session, week_id: int, office_id: int = None):
-    week = db.query(Week).filter(Week.id == week_id).first()
-    query = db.query(Order).options(joinedload(Order.user)).filter(Order.week_id == week_id)
-    
+def _safe_week_title(week):
+    return "".join([c if c.isalnum() else "_" for c in week.title])
+
+def _week_export_path(rdb: Session, week, cache_key: str, office_id: int = None):
     office_name_str = "TODAS"
     if office_id is not None:
-        query = query.join(Order.user).filter(User.office_id == office_id)
-        office_obj = db.query(Office).filter(Office.id == office_id).first()
+        office_obj = rdb.query(Office).filter(Office.id == office_id).first()
         if office_obj: office_name_str = office_obj.name.replace(" ", "_").upper()
+    return export_file_path(_safe_week_title(week), office_name_str, cache_key)
 
-    orders = query.all()
-    data = []
-    
-    day_keys = ["monday", "tuesday", "wednesday", "thursday", "friday"] 
-    english_to_spanish = {"monday": "Lunes", "tuesday": "Martes", "wednesday": "Miércoles", "thursday": "Jueves", "friday": "Viernes"}
-    
-    final_cols = ["Usuario", "Oficina"]
-    for d_key in day_keys:
-        d_name = english_to_spanish[d_key]
-        final_cols.append(d_name)
+def _fresh_read_session(db: Session, rdb: Session, week_id: int):
+    """
+    (huella de la primaria, sesión de lectura a usar). Si la réplica todavía no tiene los últimos
+    cambios de la semana se lee de la primaria. Todo lo que se exporte (semana, oficinas, pedidos)
+    tiene que salir de la sesión devuelta, o el archivo quedaría cacheado con datos viejos.
+    """
+    fingerprint = week_data_fingerprint(db, week_id)
+    if fingerprint is not None and rdb is not db and week_data_fingerprint(rdb, week_id) != fingerprint:
+        rdb = db
+    return fingerprint, rdb
 
-    menu_item_cache = {}
-    
-    def get_desc(item_id):
-        if item_id is None: return None
-        try: val_id = int(item_id)
-        except: return "ID Inválido"
-
-        if val_id not in menu_item_cache:
-            mi = db.query(MenuItem).filter(MenuItem.id == val_id).first()
-            if mi: menu_item_cache[val_id] = mi.description
-            else: menu_item_cache[val_id] = None
-        return menu_item_cache.get(val_id)
-
-    closed_days_list = week.closed_days if week.closed_days else []
-
-    for order in orders:
-        details = order.details
-        if isinstance(details, str):
-            try: details = json.loads(details)
-            except: details = {}
-            
-        user_office = order.user.office.name if order.user.office else "Sin Oficina"
-        row = {"Usuario": order.user.full_name, "Oficina": user_office}
-        
-        for day in day_keys:
-            d_es = english_to_spanish[day]
-            
-            if day in closed_days_list:
-                row[d_es] = "FERIADO"
-                continue
-                
-            day_order = details.get(day, {})
-            tipo = day_order.get("tipo", "nada")
-            
-            texto_pedido = "NO PEDIDO"
-            
-            if order.status == "no_pedido" or tipo == "nada":
-                texto_pedido = "NO PEDIDO"
-            elif tipo == "completo":
-                comp_id = day_order.get("plato_id")
-                desc = get_desc(comp_id)
-                if desc: texto_pedido = desc 
-            elif tipo == "combinado":
-                prot_id = day_order.get("proteina_id")
-                guar_id = day_order.get("guarnicion_id")
-                
-                p_desc = get_desc(prot_id)
-                g_desc = get_desc(guar_id)
-                
-                partes = []
-                if p_desc: partes.append(p_desc)
-                if g_desc: partes.append(g_desc)
-                
-                if partes:
-                    texto_pedido = " + ".join(partes)
-            
-            row[d_es] = texto_pedido
-            
-        data.append(row)
-
-    df = pd.DataFrame(data, columns=final_cols).fillna("")
-    safe_title = "".join([c if c.isalnum() else "_" for c in week.title])
-    filename = f"{safe_title}_{office_name_str}_{datetime.now().strftime('%Y%m%d')}.xlsx"
-    path = f"data/exports/{filename}"
-    os.makedirs("data/exports", exist_ok=True)
-    df.to_excel(path, index=False) 
-    log = ExportLog(week_id=week_id, filename=path); db.add(log); db.commit()
-    return path, "Exportación exitosa"
+def export_week_to_excel(db: Session, week_id: int, office_id: int = None, streaming: bool = False, use_cache: bool = True, log: ExportLog = None, read_db: Session = None):
+    """
+    Genera el Excel semanal (Usuario, Oficina, Lunes…Viernes).
+    Con streaming=True lee los pedidos por bloques y escribe directo a un workbook write-only,
+    así la memoria no crece con la cantidad de pedidos.
+    Si ya existe una exportación con la misma (semana, oficina, versión de datos) se devuelve esa.
+    Los datos se leen de read_db (por defecto la réplica, si hay); el registro se escribe en db.
+    """
+    with read_session(read_db) as session, count_queries() as counter:
+        fingerprint, rdb = _fresh_read_session(db, session, week_id)
+        week = rdb.query(Week).filter(Week.id == week_id).first() if fingerprint else None
+        if not week: return None, "Semana no encontrada."
+
+        cache_key = export_cache_key(week_id, office_id, fingerprint)
+        if use_cache:
+            cached_path = find_cached_export(db, cache_key)
+            if cached_path:
+                record_export(db, week_id, office_id, cached_path, cache_key, cache_hit=True, log=log)
+                return cached_path, "Exportación sin cambios (desde caché)"
+
+        path = _week_export_path(rdb, week, cache_key, office_id)
+
+        # Hoja extra para la cocina: cantidades por día y plato
+        kitchen_df = get_kitchen_summary(rdb, week_id, office_id)
+
+        if streaming:
+            with staged_file(path) as staging:
+                write_rows_streaming(staging, iter_week_rows(rdb, week, office_id), extra_sheets={KITCHEN_SHEET: kitchen_df})
+        else:
+            data = build_week_rows(rdb, week, office_id)
+
+    if not streaming:
+        df = pd.DataFrame(data, columns=EXPORT_COLUMNS).fillna("")
+        with staged_file(path) as staging, pd.ExcelWriter(staging) as writer:
+            df.to_excel(writer, index=False) 
+            kitchen_df.to_excel(writer, sheet_name=KITCHEN_SHEET, index=False)
+    record_export(db, week_id, office_id, path, cache_key, cache_hit=False, log=log)
+    return path, f"Exportación exitosa ({counter.summary()})"
+
+def export_week_bundle(db: Session, week_id: int, as_zip: bool = False, use_cache: bool = True, log: ExportLog = None, read_db: Session = None):
+    """
+    Exporta todas las oficinas recorriendo los pedidos de la semana UNA sola vez.
+    as_zip=False: un XLSX con hoja 'Consolidado' + una hoja por oficina.
+    as_zip=True: un ZIP con un XLSX por oficina.
+    """
+    with read_session(read_db) as session, count_queries() as counter:
+        fingerprint, rdb = _fresh_read_session(db, session, week_id)
+        week = rdb.query(Week).filter(Week.id == week_id).first() if fingerprint else None
+        if not week: return None, "Semana no encontrada."
+        office_names = [name for (name,) in rdb.query(Office.name).order_by(Office.name).all()]
+
+        # Las hojas dependen de las oficinas existentes, así que forman parte de la clave
+        variant = ("bundle_zip|" if as_zip else "bundle_xlsx|") + "|".join(office_names)
+        cache_key = export_cache_key(week_id, None, fingerprint, variant)
+        if use_cache:
+            cached_path = find_cached_export(db, cache_key)
+            if cached_path:
+                record_export(db, week_id, None, cached_path, cache_key, cache_hit=True, log=log)
+                return cached_path, "Exportación sin cambios (desde caché)"
+
+        safe_title = _safe_week_title(week)
+        date_str = datetime.now().strftime('%Y%m%d')
+        path = export_file_path(safe_title, "POR_OFICINA", cache_key, "zip" if as_zip else "xlsx")
+
+        kitchen_df = get_kitchen_summary(rdb, week_id)
+        rows = iter_week_rows(rdb, week)
+        with staged_file(path) as staging:
+            if as_zip:
+                counts = write_office_bundle_zip(
+                    staging, rows, office_names, safe_title, date_str,
+                    office_extra_sheets=lambda name: {KITCHEN_SHEET: kitchen_df[kitchen_df["Oficina"] == name]}
+                )
+            else:
+                counts = write_office_bundle_xlsx(staging, rows, office_names, extra_sheets={KITCHEN_SHEET: kitchen_df})
+
+    record_export(db, week_id, None, path, cache_key, cache_hit=False, log=log)
+    return path, f"Exportación de {len(counts)} oficinas exitosa ({counter.summary()})"
 
 def reopen_week_logic(db: Session, week_id: int):
     """Cambia el estado de una semana de Cerrada a Abierta."""
@@ -214,7 +391,10 @@ def reopen_week_logic(db: Session, week_id: int):
     
     try:
         week.is_open = True
+        week.is_finalized = False
         db.commit()
+        rearm_auto_close()
+        invalidate_open_week()
         return True, "Semana reabierta exitosamente."
     except Exception as e:
         db.rollback()
@@ -251,7 +431,9 @@ def clone_menu_from_week(db: Session, source_week_id: int, target_week_id: int):
                 description=item.description
             )
             db.add(new_item)
+        bump_week_data_version(db, target_week_id)
         db.commit()
+        invalidate_menu(target_week_id)
         return True, f"✅ Se copiaron {len(source_items)} platos desde '{source_week.title}' con éxito."
     except Exception as e:
         db.rollback()
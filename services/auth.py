@@ -1,52 +1,89 @@
 # services/auth.py
-import bcrypt
 from sqlalchemy.orm import Session
 from database.models import User, Office
+from services.export_cache import bump_user_weeks_data_version
+from services.cache import bump_user_directory
+from services.hashing import hash_password, hash_passwords, check_password, needs_rehash, BCRYPT_MAX_BYTES
+from services.session_tokens import revoke_user_sessions, forget_session_user
+from services import login_throttle
 
-# --- FUNCIONES CORE (HASHING - VERSIÓN BCRYPT DIRECTA) ---
+# --- FUNCIONES CORE (HASHING - BCRYPT EN POOL DE PROCESOS) ---
 
 def get_password_hash(password: str) -> str:
-    """Genera un hash seguro de la contraseña usando bcrypt puro."""
-    # Convertimos la contraseña a bytes
-    pwd_bytes = password.encode('utf-8')
-    # Generamos la salt y el hash
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(pwd_bytes, salt)
-    # Devolvemos el hash como string para guardarlo en la DB
-    return hashed.decode('utf-8')
+    """Genera un hash bcrypt con el costo configurado (AUTH_BCRYPT_ROUNDS), fuera del hilo de Streamlit."""
+    return hash_password(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verifica si la contraseña coincide con el hash."""
+    """Verifica si la contraseña coincide con el hash (False si el hash no es válido)."""
     try:
-        # bcrypt necesita bytes para ambos argumentos
-        pwd_bytes = plain_password.encode('utf-8')
-        # Si el hash viene de la DB como string, lo pasamos a bytes
-        hash_bytes = hashed_password.encode('utf-8')
-        
-        return bcrypt.checkpw(pwd_bytes, hash_bytes)
+        return check_password(plain_password, hashed_password)
     except Exception:
-        # Si el formato del hash es incorrecto o hay otro error
         return False
 
 # --- AUTENTICACIÓN (LOGIN) ---
 
-def authenticate_user(db: Session, username: str, password: str):
-    """Busca al usuario y valida su contraseña."""
+def authenticate_user(db: Session, username: str, password: str, client: str = None):
+    """
+    Busca al usuario y valida su contraseña. Devuelve el usuario o None.
+    client: IP o sesión del navegador (login_throttle.client_key()) para el límite por cliente.
+    """
+    return try_login(db, username, password, client)[0]
+
+def try_login(db: Session, username: str, password: str, client: str = None):
+    """
+    Como authenticate_user, pero devuelve (usuario o None, espera). espera > 0 solo si el intento
+    se rechazó por el límite ANTES de verificar la contraseña (sin gastar un bcrypt); un intento
+    fallido que consumió la última ficha devuelve espera 0: la contraseña sí se verificó.
+    """
+    allowed, wait = login_throttle.acquire(username, client)
+    if not allowed:
+        return None, wait
+    return _authenticate(db, username, password), 0.0
+
+def _authenticate(db: Session, username: str, password: str):
+    # Usuario inexistente (recién consultado o en la caché negativa): mismo costo que una contraseña incorrecta
+    if login_throttle.is_unknown_user(username):
+        login_throttle.record_failure()
+        login_throttle.dummy_check(password, verify_password)
+        return None
+
     user = db.query(User).filter(User.username == username).first()
     
     if not user:
+        login_throttle.remember_unknown_user(username)
+        login_throttle.record_failure()
+        login_throttle.dummy_check(password, verify_password)
         return None
     
     # Validamos la contraseña usando la función robusta
     if not verify_password(password, user.password_hash):
+        login_throttle.record_failure()
         return None
         
     if not user.is_active:
+        login_throttle.record_failure()
         return None
+
+    login_throttle.record_success(username)
+
+    # Hash con otro costo que el configurado: aprovechamos que tenemos la contraseña para rehacerlo
+    if needs_rehash(user.password_hash):
+        try:
+            user.password_hash = get_password_hash(password)
+            db.commit()
+            db.refresh(user)  # El login usa el objeto después de cerrar la sesión
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ No se pudo actualizar el hash de {username}: {e}")
         
     return user
 
 # --- GESTIÓN DE USUARIOS (CRUD) ---
+def password_length_error(password: str):
+    """Mensaje de error si bcrypt no acepta la contraseña (más de BCRYPT_MAX_BYTES), o None."""
+    if len(password.encode("utf-8")) > BCRYPT_MAX_BYTES:
+        return f"Contraseña demasiado larga (máximo {BCRYPT_MAX_BYTES} bytes)."
+    return None
 
 def create_user(db: Session, username, full_name, password, office_id: int = None, role="user"):
     """Crea un nuevo usuario asignando su oficina."""
@@ -56,6 +93,9 @@ def create_user(db: Session, username, full_name, password, office_id: int = Non
         return False, f"El usuario '{username}' ya existe."
 
     # 2. Hashear password
+    length_error = password_length_error(password)
+    if length_error:
+        return False, length_error
     hashed_password = get_password_hash(password)
     
     # 3. Validar oficina (si se envió un ID)
@@ -78,11 +118,106 @@ def create_user(db: Session, username, full_name, password, office_id: int = Non
     try:
         db.commit()
         db.refresh(new_user)
+        bump_user_directory()
+        login_throttle.forget_unknown_user(username)
         return True, "Usuario creado exitosamente."
     except Exception as e:
         db.rollback()
         return False, f"Error al crear usuario: {e}"
 
+USER_ROLES = ("user", "admin")
+IN_CHUNK = 500  # Valores por IN (...): SQLite limita los parámetros por sentencia
+
+def _existing_values(db: Session, column, values):
+    """Subconjunto de values que ya existe en la columna (una consulta por tramo de IN_CHUNK)."""
+    values = list(values)
+    found = set()
+    for i in range(0, len(values), IN_CHUNK):
+        found.update(v for (v,) in db.query(column).filter(column.in_(values[i:i + IN_CHUNK])).all())
+    return found
+
+def bulk_create_users(db: Session, rows, dry_run: bool = False):
+    """
+    Alta masiva (onboarding de una oficina). rows: dicts con username, full_name, password,
+    office (nombre) y role (opcional, 'user' por defecto); 'row' es el número de fila del archivo.
+    Valida todo con dos consultas (usuarios existentes y oficinas por nombre), hashea en paralelo
+    y guarda las filas válidas en una sola transacción. Las filas con error se informan y no se crean.
+    Devuelve (creados, errores) donde errores es una lista de {"Fila", "Usuario", "Error"}.
+    """
+    errors = []
+    candidates = []
+    seen = set()
+    for i, raw in enumerate(rows, start=1):
+        row_number = raw.get("row", i)
+        username = str(raw.get("username") or "").strip()
+        full_name = str(raw.get("full_name") or "").strip()
+        password = str(raw.get("password") or "")
+        office = str(raw.get("office") or "").strip()
+        role = str(raw.get("role") or "").strip().lower() or "user"
+        length_error = password_length_error(password)
+
+        if not (username and full_name and password and office):
+            problem = "Faltan datos (usuario, nombre, contraseña y oficina son obligatorios)."
+        elif length_error:
+            problem = length_error
+        elif role not in USER_ROLES:
+            problem = f"Rol '{role}' inválido (use {' o '.join(USER_ROLES)})."
+        elif username in seen:
+            problem = "Usuario repetido en el archivo."
+        else:
+            problem = None
+        if problem:
+            errors.append({"Fila": row_number, "Usuario": username, "Error": problem})
+            continue
+        seen.add(username)
+        candidates.append((row_number, username, full_name, password, office, role))
+
+    # Dos consultas de conjunto en vez de dos por usuario
+    taken = _existing_values(db, User.username, seen)
+    office_names = sorted({c[4] for c in candidates})
+    office_ids = {}
+    for i in range(0, len(office_names), IN_CHUNK):
+        chunk = office_names[i:i + IN_CHUNK]
+        office_ids.update(db.query(Office.name, Office.id).filter(Office.name.in_(chunk)).all())
+
+    valid = []
+    for candidate in candidates:
+        row_number, username, _, _, office, _ = candidate
+        if username in taken:
+            errors.append({"Fila": row_number, "Usuario": username, "Error": f"El usuario '{username}' ya existe."})
+        elif office not in office_ids:
+            errors.append({"Fila": row_number, "Usuario": username, "Error": f"La oficina '{office}' no existe."})
+        else:
+            valid.append(candidate)
+    errors.sort(key=lambda e: e["Fila"])
+
+    if dry_run or not valid:
+        # dry_run: cuántos se crearían
+        return (len(valid) if dry_run else 0), errors
+
+    try:
+        # bcrypt repartido entre los procesos del pool (el mismo orden que valid)
+        hashes = hash_passwords([c[3] for c in valid])
+    except Exception as e:
+        return 0, errors + [{"Fila": None, "Usuario": "", "Error": f"Error al hashear las contraseñas (no se creó ningún usuario): {e}"}]
+    mappings = [
+        {"username": username, "full_name": full_name, "password_hash": hashed, "role": role,
+         "office_id": office_ids[office], "is_active": True, "session_epoch": 0}
+        for (_, username, full_name, _, office, role), hashed in zip(valid, hashes)
+    ]
+    try:
+        db.bulk_insert_mappings(User, mappings)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        # Todo o nada: si falla el guardado no queda ninguna fila a medias
+        return 0, errors + [{"Fila": None, "Usuario": "", "Error": f"Error al guardar (no se creó ningún usuario): {e}"}]
+
+    bump_user_directory()
+    for c in valid:
+        login_throttle.forget_unknown_user(c[1])
+    return len(mappings), errors
+
 def update_user_details(db: Session, user_id: int, username: str, full_name: str, office_id: int, role: str, is_active: bool):
     """Actualiza datos del perfil, incluyendo la oficina."""
     user = db.query(User).filter(User.id == user_id).first()
@@ -96,13 +231,22 @@ def update_user_details(db: Session, user_id: int, username: str, full_name: str
             return False, f"El usuario '{username}' ya existe. Elija otro."
 
     try:
+        # Al desactivarlo se cierran sus sesiones abiertas (tokens emitidos)
+        if user.is_active and not is_active:
+            revoke_user_sessions(db, user_id)
+
         user.username = username
         user.full_name = full_name
         user.role = role
         user.is_active = is_active
         user.office_id = office_id # Actualizamos la oficina
         
+        # Nombre y oficina aparecen en los Excel de sus semanas: invalidamos esas exportaciones
+        bump_user_weeks_data_version(db, user_id)
         db.commit()
+        bump_user_directory()
+        forget_session_user(user_id)
+        login_throttle.forget_unknown_user(username)
         return True, "Datos actualizados correctamente."
     except Exception as e:
         db.rollback()
@@ -116,10 +260,16 @@ def reset_user_password(db: Session, user_id: int, new_password: str, actor_id:
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         return False, "Usuario no encontrado."
+    length_error = password_length_error(new_password)
+    if length_error:
+        return False, length_error
     
     try:
         user.password_hash = get_password_hash(new_password)
+        # Quien tenga una sesión abierta con la contraseña anterior debe volver a entrar
+        revoke_user_sessions(db, user_id)
         db.commit()
+        forget_session_user(user_id)
         return True, "Contraseña actualizada correctamente."
     except Exception as e:
         db.rollback()
@@ -0,0 +1,199 @@
+# services/cache.py
+# Cachés de proceso para datos que se leen en cada rerun y cambian muy poco.
+# Se invalidan explícitamente desde las funciones que modifican esos datos (después del commit).
+# Como puede haber más de un proceso, cada entrada además vence sola después de un TTL corto.
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+from types import MappingProxyType
+from sqlalchemy.orm import Session
+from database.models import MenuItem, Week, Office, User
+from services.export_service import DAY_KEYS
+
+MENU_TYPES = ["Proteína", "Guarnición", "Plato Completo"]
+
+# Tope de vida de una entrada aunque nadie la invalide (cambios hechos desde otro proceso)
+MENU_CACHE_TTL = 60
+OPEN_WEEK_TTL = 60
+REFERENCE_TTL = 60
+
+# --- MENÚ SEMANAL ---
+MenuEntry = namedtuple("MenuEntry", ["id", "description", "option_number"])
+
+class WeekMenu:
+    """
+    Menú de una semana, inmutable y compartido entre todas las sesiones.
+    days[día][tipo] -> tupla de MenuEntry (mismo orden que en la BD).
+    """
+    __slots__ = ("week_id", "days", "_names", "_ids")
+
+    def __init__(self, week_id: int, entries_by_day_type: dict):
+        self.week_id = week_id
+        self.days = MappingProxyType({
+            day: MappingProxyType({t: tuple(entries_by_day_type.get((day, t), ())) for t in MENU_TYPES})
+            for day in DAY_KEYS
+        })
+        # Lookups por (día, tipo): id -> descripción y descripción -> id
+        self._names = {key: {e.id: e.description for e in entries} for key, entries in entries_by_day_type.items()}
+        self._ids = {key: {e.description: e.id for e in entries} for key, entries in entries_by_day_type.items()}
+
+    def description(self, day: str, item_type: str, item_id):
+        """Descripción del plato, None si no hay id o 'Plato no encontrado' si no está en el menú."""
+        if not item_id: return None
+        return self._names.get((day, item_type), {}).get(item_id, "Plato no encontrado")
+
+    def id_for(self, day: str, item_type: str, description):
+        return self._ids.get((day, item_type), {}).get(description)
+
+    def options(self, day: str, item_type: str):
+        """{descripción: id} en el orden del menú (copia: el llamador puede agregar 'Ninguno')."""
+        return dict(self._ids.get((day, item_type), {}))
+
+_menu_lock = threading.Lock()
+_menus = {}  # week_id -> (WeekMenu, vence_en)
+_menu_generation = [0]  # Sube con cada invalidación: una lectura en vuelo no puede guardar datos viejos
+
+def _load_week_menu(db: Session, week_id: int):
+    rows = db.query(MenuItem.id, MenuItem.day, MenuItem.type, MenuItem.description, MenuItem.option_number).filter(
+        MenuItem.week_id == week_id
+    ).order_by(MenuItem.id).all()
+    entries = {}
+    for item_id, day, item_type, description, option_number in rows:
+        if day in DAY_KEYS and item_type in MENU_TYPES:
+            entries.setdefault((day, item_type), []).append(MenuEntry(item_id, description, option_number))
+    return WeekMenu(week_id, entries)
+
+def get_week_menu(db: Session, week_id: int):
+    """Menú de la semana desde la caché; solo consulta la BD si no está o venció."""
+    now = time.monotonic()
+    with _menu_lock:
+        cached = _menus.get(week_id)
+        if cached and cached[1] > now:
+            return cached[0]
+        generation = _menu_generation[0]
+
+    menu = _load_week_menu(db, week_id)
+    with _menu_lock:
+        if generation == _menu_generation[0]:
+            _menus[week_id] = (menu, now + MENU_CACHE_TTL)
+    return menu
+
+def invalidate_menu(week_id: int = None):
+    """Descarta el menú cacheado de una semana (o de todas si week_id es None)."""
+    with _menu_lock:
+        _menu_generation[0] += 1
+        if week_id is None: _menus.clear()
+        else: _menus.pop(week_id, None)
+
+# --- SEMANA ABIERTA VIGENTE ---
+# Copia inmutable (no es un objeto del ORM: se comparte entre sesiones y no se vuelve a cargar)
+OpenWeek = namedtuple("OpenWeek", ["id", "title", "start_date", "end_date", "closed_days"])
+
+_open_week_lock = threading.Lock()
+_open_week = {"value": None, "expires_at": None, "generation": 0}
+
+def get_open_week(db: Session, now):
+    """
+    Semana abierta vigente (is_open y end_date > now) o None.
+    La entrada vence exactamente en el end_date de la semana: pasado el plazo se vuelve a consultar.
+    now: hora local UTC-3 (get_now_utc3), la misma referencia que end_date.
+    Con una sesión de la réplica se usa la caché pero no se la llena: una lectura atrasada
+    podría volver a publicar como abierta una semana recién finalizada.
+    """
+    with _open_week_lock:
+        expires_at = _open_week["expires_at"]
+        if expires_at is not None and now < expires_at:
+            return _open_week["value"]
+        generation = _open_week["generation"]
+
+    week = db.query(Week).filter(
+        Week.is_open == True,
+        Week.end_date > now
+    ).order_by(Week.start_date.desc()).first()
+
+    snapshot = None
+    expires_at = now + timedelta(seconds=OPEN_WEEK_TTL)
+    if week:
+        snapshot = OpenWeek(week.id, week.title, week.start_date, week.end_date, tuple(week.closed_days or ()))
+        expires_at = min(expires_at, week.end_date)
+
+    if db.info.get("replica"):
+        return snapshot
+    with _open_week_lock:
+        if generation == _open_week["generation"]:
+            _open_week.update(value=snapshot, expires_at=expires_at)
+    return snapshot
+
+def invalidate_open_week():
+    """Semana creada, cerrada, reabierta, borrada o con feriados cambiados."""
+    with _open_week_lock:
+        _open_week["generation"] += 1
+        _open_week.update(value=None, expires_at=None)
+
+# --- DATOS DE REFERENCIA VERSIONADOS (OFICINAS, DIRECTORIO DE USUARIOS) ---
+class VersionedCache:
+    """
+    Instantáneas inmutables por nombre. Cada nombre tiene un contador de versión que suben
+    las funciones que modifican esos datos; una instantánea de otra versión se vuelve a cargar.
+    """
+
+    def __init__(self, ttl: int = REFERENCE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._versions = {}   # nombre -> versión actual
+        self._snapshots = {}  # nombre -> (versión, instantánea, vence_en)
+
+    def version(self, name: str):
+        with self._lock:
+            return self._versions.get(name, 0)
+
+    def bump(self, name: str):
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+    def get(self, name: str, loader):
+        now = time.monotonic()
+        with self._lock:
+            version = self._versions.get(name, 0)
+            cached = self._snapshots.get(name)
+            if cached and cached[0] == version and cached[2] > now:
+                return cached[1]
+
+        snapshot = loader()
+        with self._lock:
+            # Si alguien subió la versión mientras cargábamos, no guardamos (pero sí devolvemos) lo leído
+            if self._versions.get(name, 0) == version:
+                self._snapshots[name] = (version, snapshot, now + self.ttl)
+        return snapshot
+
+reference_cache = VersionedCache()
+OFFICES = "offices"
+USER_DIRECTORY = "user_directory"
+
+OfficeRef = namedtuple("OfficeRef", ["id", "name"])
+UserRef = namedtuple("UserRef", ["id", "username", "full_name", "role", "office_id", "office_name", "is_active"])
+
+def get_offices(db: Session):
+    """Oficinas ordenadas por nombre, como tupla de OfficeRef."""
+    def load():
+        rows = db.query(Office.id, Office.name).order_by(Office.name).all()
+        return tuple(OfficeRef(office_id, name) for office_id, name in rows)
+    return reference_cache.get(OFFICES, load)
+
+def get_user_directory(db: Session):
+    """Todos los usuarios con el nombre de su oficina (una sola consulta), como tupla de UserRef."""
+    def load():
+        rows = db.query(
+            User.id, User.username, User.full_name, User.role, User.office_id, Office.name, User.is_active
+        ).outerjoin(Office, User.office_id == Office.id).order_by(User.id).all()
+        return tuple(UserRef(*row) for row in rows)
+    return reference_cache.get(USER_DIRECTORY, load)
+
+def bump_offices():
+    reference_cache.bump(OFFICES)
+    # El directorio muestra el nombre de la oficina de cada usuario
+    reference_cache.bump(USER_DIRECTORY)
+
+def bump_user_directory():
+    reference_cache.bump(USER_DIRECTORY)
@@ -0,0 +1,103 @@
+# services/export_cache.py
+import hashlib
+import os
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from database.models import Week, Order, ExportLog
+
+# Subir este número si cambia el formato de las planillas (invalida todo lo cacheado)
+EXPORT_FORMAT_VERSION = 5  # 5: ZIP por oficina sin nombres de archivo repetidos
+
+# --- VERSIÓN DE DATOS POR SEMANA ---
+def bump_week_data_version(db: Session, week_id: int):
+    """
+    Marca la semana como modificada. Solo para cambios del admin (menú, feriados, cierre):
+    los pedidos no la tocan, así los envíos simultáneos no se encolan en la fila de la semana.
+    Se llama dentro de la misma transacción que el cambio.
+    """
+    if week_id is None: return
+    db.query(Week).filter(Week.id == week_id).update(
+        {Week.data_version: Week.data_version + 1}, synchronize_session=False
+    )
+
+def bump_user_weeks_data_version(db: Session, user_id: int):
+    """Invalida las semanas donde el usuario tiene pedidos (su nombre/oficina aparecen en el Excel)."""
+    week_ids = db.query(Order.week_id).filter(Order.user_id == user_id)
+    db.query(Week).filter(Week.id.in_(week_ids)).update(
+        {Week.data_version: Week.data_version + 1}, synchronize_session=False
+    )
+
+def week_data_fingerprint(db: Session, week_id: int):
+    """
+    Versión de los datos de la semana para la clave de caché: data_version (cambios del admin)
+    más una huella de los pedidos derivada sin escribir nada. Cada escritura de un pedido sube su
+    version y su created_at; un alta o baja cambia la cantidad.
+    Se calcula con la sesión primaria: una réplica atrasada daría una clave vieja.
+    None si la semana no existe.
+    """
+    row = db.query(
+        Week.data_version, func.count(Order.id), func.coalesce(func.sum(Order.version), 0), func.max(Order.created_at)
+    ).outerjoin(Order, Order.week_id == Week.id).filter(Week.id == week_id).group_by(Week.id, Week.data_version).first()
+    if row is None: return None
+    data_version, count, versions, last_change = row
+    return f"{data_version or 0}.{count}.{versions}.{last_change.isoformat() if last_change else '-'}"
+
+# --- CLAVE Y BÚSQUEDA ---
+def export_cache_key(week_id: int, office_id, data_version, variant: str = "xlsx"):
+    raw = f"v{EXPORT_FORMAT_VERSION}|week={week_id}|office={office_id}|data={data_version}|{variant}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+# --- ARCHIVOS ---
+# Cada archivo lleva el prefijo de su clave en el nombre: una ruta cacheada nunca se reescribe
+# con otro contenido. Se escribe en un temporal y se mueve con os.replace (atómico), así quien
+# lee la ruta nunca ve un archivo a medio escribir.
+CACHE_KEY_PREFIX = 12
+
+def export_file_path(safe_title: str, label: str, cache_key: str, ext: str = "xlsx"):
+    filename = f"{safe_title}_{label}_{datetime.now().strftime('%Y%m%d')}_{cache_key[:CACHE_KEY_PREFIX]}.{ext}"
+    os.makedirs("data/exports", exist_ok=True)
+    return f"data/exports/{filename}"
+
+def staging_path(path: str):
+    """Temporal único junto a path, con la misma extensión (pandas elige el formato por ella)."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{uuid.uuid4().hex[:8]}.tmp{ext}"
+
+def discard_file(path: str):
+    try: os.unlink(path)
+    except FileNotFoundError: pass
+
+@contextmanager
+def staged_file(path: str):
+    """Entrega un temporal; si el bloque termina bien lo mueve a path, si falla lo borra."""
+    staging = staging_path(path)
+    try:
+        yield staging
+    except BaseException:
+        discard_file(staging)
+        raise
+    os.replace(staging, path)
+
+def find_cached_export(db: Session, cache_key: str):
+    """Devuelve la ruta de una exportación previa con la misma clave, si el archivo sigue en disco."""
+    logs = db.query(ExportLog.filename).filter(
+        ExportLog.cache_key == cache_key, ExportLog.cache_hit == False
+    ).order_by(ExportLog.id.desc()).limit(3).all()
+    for (filename,) in logs:
+        if filename and os.path.exists(filename):
+            return filename
+    return None
+
+def record_export(db: Session, week_id: int, office_id, path: str, cache_key: str, cache_hit: bool, log: ExportLog = None):
+    """Registra la exportación. Si viene de un trabajo en segundo plano, completa su fila en vez de crear otra."""
+    if log is None:
+        log = ExportLog(week_id=week_id, office_id=office_id)
+        db.add(log)
+    log.filename = path
+    log.cache_key = cache_key
+    log.cache_hit = cache_hit
+    db.commit()
+    return log
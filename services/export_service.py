@@ -0,0 +1,306 @@
+# services/export_service.py
+import io
+import json
+import zipfile
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Border, Side, Alignment
+from sqlalchemy.orm import Session
+from database.models import Order, User, MenuItem, Office
+
+# --- CONSTANTES DE EXPORTACIÓN ---
+DAY_KEYS = ["monday", "tuesday", "wednesday", "thursday", "friday"]
+ENGLISH_TO_SPANISH = {"monday": "Lunes", "tuesday": "Martes", "wednesday": "Miércoles", "thursday": "Jueves", "friday": "Viernes"}
+EXPORT_COLUMNS = ["Usuario", "Oficina"] + [ENGLISH_TO_SPANISH[d] for d in DAY_KEYS]
+NO_OFFICE_LABEL = "Sin Oficina"
+STREAM_CHUNK_SIZE = 500
+CONSOLIDATED_SHEET = "Consolidado"
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# --- TABLA DE PLATOS ---
+class DishLookup:
+    """Traduce IDs de platos a descripciones con una sola consulta por semana."""
+
+    def __init__(self, db: Session, week_id: int):
+        self.db = db
+        rows = db.query(MenuItem.id, MenuItem.description).filter(MenuItem.week_id == week_id).all()
+        self.descriptions = {item_id: desc for item_id, desc in rows}
+
+    def prefetch(self, item_ids):
+        """Resuelve en bloque los IDs que no pertenecen al menú de la semana (pedidos antiguos)."""
+        missing = {i for i in item_ids if i not in self.descriptions}
+        if not missing: return
+        rows = self.db.query(MenuItem.id, MenuItem.description).filter(MenuItem.id.in_(missing)).all()
+        found = {item_id: desc for item_id, desc in rows}
+        for item_id in missing:
+            self.descriptions[item_id] = found.get(item_id)
+
+    def get(self, item_id):
+        if item_id is None: return None
+        try: val_id = int(item_id)
+        except: return "ID Inválido"
+
+        if val_id not in self.descriptions:
+            self.prefetch([val_id])
+        return self.descriptions.get(val_id)
+
+# --- LECTURA DE PEDIDOS ---
+def parse_details(details):
+    if isinstance(details, str):
+        try: details = json.loads(details)
+        except: details = {}
+    return details or {}
+
+def referenced_dish_ids(details: dict):
+    """IDs de platos referenciados por un pedido (ignora valores no numéricos)."""
+    ids = set()
+    for day in DAY_KEYS:
+        day_order = details.get(day, {})
+        for key in ("plato_id", "proteina_id", "guarnicion_id"):
+            try: ids.add(int(day_order.get(key)))
+            except (TypeError, ValueError): pass
+    return ids
+
+def week_orders_query(db: Session, week_id: int, office_id: int = None):
+    """Pedidos de la semana con usuario y oficina resueltos en una sola consulta (sin lazy-loads)."""
+    query = db.query(
+        Order.status, Order.details, User.full_name, User.office_id, Office.name
+    ).join(User, Order.user_id == User.id).outerjoin(Office, User.office_id == Office.id).filter(Order.week_id == week_id)
+    if office_id is not None:
+        query = query.filter(User.office_id == office_id)
+    return query.order_by(Order.id)
+
+def missing_users_query(db: Session, week_id: int, office_id: int = None):
+    """Usuarios activos sin pedido en la semana (los que el cierre completa con 'no_pedido')."""
+    has_order = db.query(Order.id).filter(Order.user_id == User.id, Order.week_id == week_id).exists()
+    query = db.query(User.full_name, Office.name).outerjoin(Office, User.office_id == Office.id).filter(
+        User.is_active == True, ~has_order
+    )
+    if office_id is not None:
+        query = query.filter(User.office_id == office_id)
+    return query.order_by(User.id)
+
+# --- CONSTRUCCIÓN DE FILAS ---
+def build_export_row(status, details, full_name, office_name, closed_days_list, dishes: DishLookup):
+    row = {"Usuario": full_name, "Oficina": office_name if office_name else NO_OFFICE_LABEL}
+
+    for day in DAY_KEYS:
+        d_es = ENGLISH_TO_SPANISH[day]
+
+        if day in closed_days_list:
+            row[d_es] = "FERIADO"
+            continue
+
+        day_order = details.get(day, {})
+        tipo = day_order.get("tipo", "nada")
+
+        texto_pedido = "NO PEDIDO"
+
+        if status == "no_pedido" or tipo == "nada":
+            texto_pedido = "NO PEDIDO"
+        elif tipo == "completo":
+            desc = dishes.get(day_order.get("plato_id"))
+            if desc: texto_pedido = desc
+        elif tipo == "combinado":
+            p_desc = dishes.get(day_order.get("proteina_id"))
+            g_desc = dishes.get(day_order.get("guarnicion_id"))
+
+            partes = []
+            if p_desc: partes.append(p_desc)
+            if g_desc: partes.append(g_desc)
+
+            if partes:
+                texto_pedido = " + ".join(partes)
+
+        row[d_es] = texto_pedido
+
+    return row
+
+def build_week_rows(db: Session, week, office_id: int = None):
+    """
+    Genera las filas del reporte semanal con un número constante de consultas:
+    pedidos+usuarios+oficinas, menú de la semana y, si hace falta, un lote de platos externos.
+    """
+    records = week_orders_query(db, week.id, office_id).all()
+    dishes = DishLookup(db, week.id)
+    closed_days_list = week.closed_days if week.closed_days else []
+
+    parsed = [(status, parse_details(details), full_name, office_name) for status, details, full_name, _, office_name in records]
+
+    referenced = set()
+    for _, details, _, _ in parsed:
+        referenced |= referenced_dish_ids(details)
+    dishes.prefetch(referenced)
+
+    return [build_export_row(status, details, full_name, office_name, closed_days_list, dishes) for status, details, full_name, office_name in parsed]
+
+# --- MODO STREAMING (MEMORIA ACOTADA) ---
+def iter_week_rows(db: Session, week, office_id: int = None, chunk_size: int = STREAM_CHUNK_SIZE, include_missing_users: bool = False):
+    """
+    Igual que build_week_rows, pero lee los pedidos por bloques y entrega las filas de a una.
+    Los platos que no son de la semana se resuelven con una consulta por bloque, no por pedido.
+    include_missing_users=True agrega al final los usuarios sin pedido como 'no_pedido', tal como
+    quedarán después del cierre (así el cierre puede armar el archivo antes de escribir nada).
+    """
+    dishes = DishLookup(db, week.id)
+    closed_days_list = week.closed_days if week.closed_days else []
+
+    def flush(batch):
+        referenced = set()
+        for _, details, _, _ in batch:
+            referenced |= referenced_dish_ids(details)
+        dishes.prefetch(referenced)
+        for status, details, full_name, office_name in batch:
+            yield build_export_row(status, details, full_name, office_name, closed_days_list, dishes)
+
+    batch = []
+    for status, details, full_name, _, office_name in week_orders_query(db, week.id, office_id).yield_per(chunk_size):
+        batch.append((status, parse_details(details), full_name, office_name))
+        if len(batch) >= chunk_size:
+            yield from flush(batch)
+            batch = []
+    yield from flush(batch)
+
+    if include_missing_users:
+        for full_name, office_name in missing_users_query(db, week.id, office_id).yield_per(chunk_size):
+            yield build_export_row("no_pedido", {}, full_name, office_name, closed_days_list, dishes)
+
+def _header_cells(ws):
+    # Mismo estilo de cabecera que pandas.to_excel para que las planillas no cambien
+    thin = Side(style="thin")
+    cells = []
+    for col in EXPORT_COLUMNS:
+        cell = WriteOnlyCell(ws, value=col)
+        cell.font = Font(bold=True)
+        cell.border = Border(left=thin, right=thin, top=thin, bottom=thin)
+        cell.alignment = Alignment(horizontal="center", vertical="top")
+        cells.append(cell)
+    return cells
+
+def write_rows_to_sheet(ws, rows):
+    """Escribe cabecera + filas en una hoja write-only. Devuelve la cantidad de filas."""
+    ws.append(_header_cells(ws))
+    count = 0
+    for row in rows:
+        ws.append([row.get(col, "") for col in EXPORT_COLUMNS])
+        count += 1
+    return count
+
+def write_dataframe_sheet(wb, df, title: str):
+    """Agrega una hoja write-only con un DataFrame chico (ej. el resumen de cocina)."""
+    ws = wb.create_sheet(title)
+    thin = Side(style="thin")
+    header = []
+    for col in df.columns:
+        cell = WriteOnlyCell(ws, value=col)
+        cell.font = Font(bold=True)
+        cell.border = Border(left=thin, right=thin, top=thin, bottom=thin)
+        cell.alignment = Alignment(horizontal="center", vertical="top")
+        header.append(cell)
+    ws.append(header)
+    for values in df.itertuples(index=False):
+        ws.append([v.item() if hasattr(v, "item") else v for v in values])
+    return ws
+
+def write_rows_streaming(path: str, rows, sheet_title: str = "Sheet1", extra_sheets: dict = None):
+    """Vuelca un iterable de filas a un XLSX write-only sin materializar la semana en memoria."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_title)
+    count = write_rows_to_sheet(ws, rows)
+    for title, df in (extra_sheets or {}).items():
+        write_dataframe_sheet(wb, df, title)
+    wb.save(path)
+    return count
+
+# --- PAQUETE MULTI-OFICINA (UNA SOLA PASADA) ---
+def safe_sheet_title(name: str, used: set):
+    """Nombre de hoja válido para Excel (sin []:*?/\\, máx. 31 caracteres y sin repetir)."""
+    clean = "".join("_" if c in '[]:*?/\\' else c for c in name).strip() or "Hoja"
+    title = clean[:31]
+    n = 2
+    while title.lower() in used:
+        suffix = f" ({n})"
+        title = clean[:31 - len(suffix)] + suffix
+        n += 1
+    used.add(title.lower())
+    return title
+
+def office_file_tag(office_name: str):
+    return office_name.replace(" ", "_").upper()
+
+def unique_file_name(stem: str, ext: str, used: set):
+    """Nombre de archivo sin repetir dentro de un ZIP (oficinas distintas pueden dar el mismo tag)."""
+    name = f"{stem}.{ext}"
+    n = 2
+    while name.lower() in used:
+        name = f"{stem}_{n}.{ext}"
+        n += 1
+    used.add(name.lower())
+    return name
+
+def write_office_bundle_xlsx(path: str, rows, office_names, extra_sheets: dict = None):
+    """
+    Un workbook con una hoja consolidada más una hoja por oficina.
+    Todas las hojas son write-only y se llenan en paralelo mientras se recorren las filas.
+    Devuelve {oficina: cantidad_de_filas}.
+    """
+    wb = Workbook(write_only=True)
+    used = set()
+    consolidated = wb.create_sheet(safe_sheet_title(CONSOLIDATED_SHEET, used))
+    consolidated.append(_header_cells(consolidated))
+
+    sheets = {}
+    def sheet_for(office_name):
+        if office_name not in sheets:
+            ws = wb.create_sheet(safe_sheet_title(office_name, used))
+            ws.append(_header_cells(ws))
+            sheets[office_name] = ws
+        return sheets[office_name]
+
+    counts = {name: 0 for name in office_names}
+    for name in office_names:
+        sheet_for(name)
+
+    for row in rows:
+        values = [row.get(col, "") for col in EXPORT_COLUMNS]
+        consolidated.append(values)
+        sheet_for(row["Oficina"]).append(values)
+        counts[row["Oficina"]] = counts.get(row["Oficina"], 0) + 1
+
+    for title, df in (extra_sheets or {}).items():
+        write_dataframe_sheet(wb, df, safe_sheet_title(title, used))
+    wb.save(path)
+    return counts
+
+def write_office_bundle_zip(path: str, rows, office_names, file_prefix: str, file_suffix: str, office_extra_sheets=None):
+    """
+    ZIP con un XLSX por oficina (mismo nombre de archivo que la exportación individual).
+    office_extra_sheets(oficina) -> {titulo: DataFrame} permite agregar hojas por archivo.
+    """
+    books = {}
+    def sheet_for(office_name):
+        if office_name not in books:
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet("Sheet1")
+            ws.append(_header_cells(ws))
+            books[office_name] = (wb, ws)
+        return books[office_name][1]
+
+    counts = {name: 0 for name in office_names}
+    for name in office_names:
+        sheet_for(name)
+
+    for row in rows:
+        sheet_for(row["Oficina"]).append([row.get(col, "") for col in EXPORT_COLUMNS])
+        counts[row["Oficina"]] = counts.get(row["Oficina"], 0) + 1
+
+    used = set()
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for office_name, (wb, _) in books.items():
+            if office_extra_sheets:
+                for title, df in office_extra_sheets(office_name).items():
+                    write_dataframe_sheet(wb, df, title)
+            buffer = io.BytesIO()
+            wb.save(buffer)
+            zf.writestr(unique_file_name(f"{file_prefix}_{office_file_tag(office_name)}_{file_suffix}", "xlsx", used), buffer.getvalue())
+    return counts
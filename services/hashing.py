@@ -0,0 +1,175 @@
+# services/hashing.py
+# bcrypt fuera del hilo de Streamlit: un pool de procesos acotado hace el trabajo de CPU
+# (100-300 ms por hash) para que un pico de logins no congele los reruns de las demás sesiones.
+# Este módulo se importa también en los procesos del pool: solo dependencias livianas arriba.
+import os
+import threading
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+
+DEFAULT_ROUNDS = 12          # Mismo costo que bcrypt.gensalt() por defecto
+BCRYPT_MAX_BYTES = 72        # bcrypt rechaza (ValueError) contraseñas más largas
+LATENCY_SAMPLES = 500        # Últimas mediciones usadas para promedio y p95
+PENDING_PER_WORKER = 8       # Cola máxima por proceso: más allá, el que llega espera su turno
+
+def _as_int(name: str, value, source: str, default: int):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        print(f"⚠️ Valor inválido para {name} en {source} ({value!r}): se usa {default}.")
+        return default
+
+def auth_setting(name: str, default: int):
+    """
+    Variable de entorno AUTH_<NAME> o sección [auth] de los secretos (entero).
+    Un valor mal escrito no tumba la app al importar: se avisa y se usa el valor por defecto.
+    """
+    env_value = os.environ.get(f"AUTH_{name.upper()}")
+    if env_value is not None:
+        return _as_int(name, env_value, f"AUTH_{name.upper()}", default)
+    if multiprocessing.parent_process() is not None:
+        return default  # Proceso del pool: no necesita la configuración (y así no importa streamlit)
+    try:
+        import streamlit as st
+        if "auth" in st.secrets and name in st.secrets.auth:
+            value = st.secrets.auth[name]
+        else:
+            return default
+    except Exception:
+        return default
+    return _as_int(name, value, f"[auth] {name}", default)
+
+BCRYPT_ROUNDS = auth_setting("bcrypt_rounds", DEFAULT_ROUNDS)
+HASH_WORKERS = auth_setting("hash_workers", min(4, os.cpu_count() or 1))  # 0 = en el mismo hilo
+
+# --- TRABAJO DE CPU (CORRE EN LOS PROCESOS DEL POOL) ---
+def _hash_in_worker(password: str, rounds: int):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=rounds)).decode("utf-8")
+
+def _check_in_worker(password: str, hashed: str):
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+    except Exception:
+        # Formato de hash inválido (ej. contraseña vieja en texto plano)
+        return False
+
+# --- MÉTRICAS ---
+class HashMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.completed = 0
+        self.errors = 0
+        self.latencies_ms = deque(maxlen=LATENCY_SAMPLES)  # espera en cola + hash
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def finished(self, elapsed_ms: float, ok: bool = True):
+        with self._lock:
+            self.in_flight -= 1
+            if ok:
+                self.completed += 1
+                self.latencies_ms.append(elapsed_ms)
+            else:
+                self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self.latencies_ms)
+            return {
+                "workers": HASH_WORKERS,
+                "rounds": BCRYPT_ROUNDS,
+                "queue_depth": self.in_flight,
+                "max_queue_depth": self.max_in_flight,
+                "completed": self.completed,
+                "errors": self.errors,
+                "avg_ms": sum(samples) / len(samples) if samples else 0.0,
+                "p95_ms": samples[max(int(len(samples) * 0.95) - 1, 0)] if samples else 0.0,
+            }
+
+hash_metrics = HashMetrics()
+
+# --- POOL ---
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(HASH_WORKERS, 1) * PENDING_PER_WORKER)
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None and HASH_WORKERS > 0:
+            # spawn: el proceso de Streamlit tiene hilos y fork con hilos no es seguro
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _run(fn, *args):
+    """Ejecuta fn en el pool (o en línea si está desactivado) y registra espera + duración."""
+    started = time.perf_counter()
+    hash_metrics.started()
+    ok = False
+    try:
+        with _slots:
+            pool = _get_pool()
+            if pool is None:
+                result = fn(*args)
+            else:
+                try:
+                    result = pool.submit(fn, *args).result()
+                except (BrokenProcessPool, OSError) as e:
+                    # Pool roto (proceso muerto, entorno sin multiprocessing): no dejamos a nadie sin login.
+                    # Cualquier otra excepción es de fn (ej. ValueError de bcrypt) y llega tal cual al llamador.
+                    print(f"⚠️ Pool de hashing no disponible, calculando en línea: {e}")
+                    _reset_pool()
+                    result = fn(*args)
+        ok = True
+        return result
+    finally:
+        hash_metrics.finished((time.perf_counter() - started) * 1000, ok)
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+# --- API ---
+def hash_password(password: str, rounds: int = None) -> str:
+    return _run(_hash_in_worker, password, rounds or BCRYPT_ROUNDS)
+
+def hash_passwords(passwords, rounds: int = None):
+    """
+    Varios hashes en paralelo, uno por proceso del pool (altas masivas).
+    Nunca hay más de HASH_WORKERS en vuelo: un login que llega espera a lo sumo un hash, no toda la lista.
+    """
+    passwords = list(passwords)
+    if HASH_WORKERS <= 1 or len(passwords) <= 1:
+        return [hash_password(p, rounds) for p in passwords]
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        return list(executor.map(lambda p: hash_password(p, rounds), passwords))
+
+def check_password(password: str, hashed: str) -> bool:
+    if not hashed: return False
+    return _run(_check_in_worker, password, hashed)
+
+def hash_rounds(hashed: str):
+    """Costo de un hash bcrypt ('$2b$12$...' -> 12); None si no es un hash bcrypt."""
+    try:
+        parts = hashed.split("$")
+        return int(parts[2]) if len(parts) > 3 and parts[1].startswith("2") else None
+    except (AttributeError, ValueError):
+        return None
+
+def needs_rehash(hashed: str) -> bool:
+    return hash_rounds(hashed) != BCRYPT_ROUNDS
+
+def get_hash_metrics():
+    return hash_metrics.snapshot()
@@ -0,0 +1,231 @@
+# services/job_queue.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import text, func
+from database.connection import SessionLocal
+from database.models import ExportLog
+
+# --- ESTADOS Y TIPOS DE TRABAJO ---
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+JOB_EXPORT = "export"         # Excel de una oficina (o todas si office_id es None)
+JOB_BUNDLE = "bundle"         # Excel con hoja por oficina
+JOB_BUNDLE_ZIP = "bundle_zip" # ZIP con un Excel por oficina
+JOB_FINALIZE = "finalize"     # Cierre de semana + exportación
+
+MAX_WORKERS = 2
+# El proceso dueño renueva heartbeat_at de sus trabajos (en cola o ejecutándose) cada HEARTBEAT_INTERVAL
+# segundos. Un trabajo activo sin latido por más de STALE_JOB_AFTER es huérfano (proceso reiniciado)
+# y no bloquea duplicados; uno que espera turno o tarda mucho sigue latiendo y no vence.
+HEARTBEAT_INTERVAL = 30
+STALE_JOB_AFTER = timedelta(minutes=3)
+# Espacio de nombres para los advisory locks de Postgres (clave = (namespace, week_id))
+JOB_LOCK_NAMESPACE = 7103
+
+# --- EJECUTOR DEL PROCESO ---
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="export-job")
+_lock = threading.Lock()
+_active_jobs = {}  # (tipo, semana, oficina) -> id de ExportLog
+_heartbeat_thread = None
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        with _lock:
+            log_ids = list(_active_jobs.values())
+        if not log_ids: continue
+        db = SessionLocal()
+        try:
+            db.query(ExportLog).filter(ExportLog.id.in_(log_ids), ExportLog.status.in_(ACTIVE_STATUSES)).update(
+                {ExportLog.heartbeat_at: datetime.utcnow()}, synchronize_session=False
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ No se pudo renovar el latido de los trabajos {log_ids}: {e}")
+        finally:
+            db.close()
+
+def _ensure_heartbeat():
+    """Arranca (una sola vez por proceso) el hilo que renueva el latido de los trabajos de este proceso."""
+    global _heartbeat_thread
+    with _lock:
+        if _heartbeat_thread is not None and _heartbeat_thread.is_alive():
+            return
+        _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name="export-job-heartbeat", daemon=True)
+        _heartbeat_thread.start()
+
+def _last_seen():
+    """Última señal de vida de un trabajo (columna SQL): latido, inicio o alta."""
+    return func.coalesce(ExportLog.heartbeat_at, ExportLog.started_at, ExportLog.exported_at)
+
+def _run_job(log_id: int, kind: str, week_id: int, office_id):
+    # Import diferido: admin_service no depende de este módulo, pero evitamos ciclos a futuro
+    from services.admin_service import (
+        export_week_to_excel, export_week_bundle, finalize_week_logic,
+        FINALIZE_ALREADY_DONE, FINALIZE_IN_PROGRESS
+    )
+
+    db = SessionLocal()
+    started = time.perf_counter()
+    log = None
+    try:
+        log = db.get(ExportLog, log_id)
+        if log is None:
+            raise RuntimeError(f"no se encontró el registro #{log_id}")
+        log.status = JOB_RUNNING
+        log.started_at = log.heartbeat_at = datetime.utcnow()
+        db.commit()
+
+        finalize_status = None
+        if kind == JOB_FINALIZE:
+            finalize_status, path, msg, _ = finalize_week_logic(db, week_id, log=log)
+        elif kind == JOB_BUNDLE:
+            path, msg = export_week_bundle(db, week_id, as_zip=False, log=log)
+        elif kind == JOB_BUNDLE_ZIP:
+            path, msg = export_week_bundle(db, week_id, as_zip=True, log=log)
+        else:
+            # Una oficina es chica: va por pandas. El consolidado (todas) va en streaming
+            path, msg = export_week_to_excel(db, week_id, office_id, streaming=office_id is None, log=log)
+
+        log = db.get(ExportLog, log_id)
+        # Semana ya cerrada (o cerrándose en otro proceso): no es un error, no hay nada que hacer
+        already_handled = finalize_status in (FINALIZE_ALREADY_DONE, FINALIZE_IN_PROGRESS)
+        if log is not None:
+            log.status = JOB_DONE if path or already_handled else JOB_FAILED
+            log.message = msg
+    except Exception as e:
+        print(f"❌ Trabajo {kind} #{log_id} falló: {e}")
+        db.rollback()
+        try:
+            log = db.get(ExportLog, log_id)
+        except Exception:
+            log = None  # La base no responde: no podemos marcarlo, el error ya quedó impreso
+        if log is not None:
+            log.status = JOB_FAILED
+            log.message = f"Error: {e}"
+    finally:
+        try:
+            if log is not None:
+                log.finished_at = datetime.utcnow()
+                log.duration_ms = int((time.perf_counter() - started) * 1000)
+                db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ No se pudo registrar el final del trabajo #{log_id}: {e}")
+        finally:
+            db.close()
+            with _lock:
+                _active_jobs.pop((kind, week_id, office_id), None)
+
+def _lock_job_submission(db, week_id: int):
+    """
+    Hace atómicos la búsqueda de un trabajo igual y el alta del nuevo, también entre procesos:
+    Postgres toma un advisory lock de la transacción; SQLite toma el lock de escritura de entrada.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:ns, :week_id)"), {"ns": JOB_LOCK_NAMESPACE, "week_id": week_id or 0})
+    elif dialect == "sqlite":
+        db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+
+def submit_job(kind: str, week_id: int, office_id: int = None, created_by: str = None):
+    """
+    Encola un trabajo de exportación/cierre y devuelve (id_de_log, es_nuevo).
+    Si ya hay uno igual en cola o ejecutándose (en este u otro proceso), devuelve ese.
+    """
+    key = (kind, week_id, office_id)
+    # _lock solo cubre el diccionario en memoria: la deduplicación real (también entre hilos de
+    # este proceso) la hace la transacción, así un envío que espera la base no frena a los demás.
+    with _lock:
+        if key in _active_jobs:
+            return _active_jobs[key], False
+
+    db = SessionLocal()
+    try:
+        _lock_job_submission(db, week_id)
+        existing = db.query(ExportLog.id).filter(
+            ExportLog.job_kind == kind,
+            ExportLog.week_id == week_id,
+            ExportLog.office_id == office_id if office_id is not None else ExportLog.office_id.is_(None),
+            ExportLog.status.in_(ACTIVE_STATUSES),
+            _last_seen() > datetime.utcnow() - STALE_JOB_AFTER
+        ).order_by(ExportLog.id.desc()).first()
+        if existing:
+            return existing[0], False
+
+        log = ExportLog(
+            week_id=week_id, office_id=office_id, filename="", created_by=created_by,
+            job_kind=kind, status=JOB_QUEUED, heartbeat_at=datetime.utcnow()
+        )
+        db.add(log)
+        db.commit()
+        log_id = log.id
+    finally:
+        db.close()
+
+    with _lock:
+        _active_jobs[key] = log_id
+
+    _ensure_heartbeat()
+    _executor.submit(_run_job, log_id, kind, week_id, office_id)
+    return log_id, True
+
+def is_stale_job(job, now=None):
+    """
+    En cola o ejecutándose sin latido hace más de STALE_JOB_AFTER: su proceso se reinició y nadie
+    lo va a terminar. Los trabajos de este proceso nunca vencen (siguen en _active_jobs).
+    """
+    if job.status not in ACTIVE_STATUSES: return False
+    with _lock:
+        if job.id in _active_jobs.values(): return False
+    last_seen = job.heartbeat_at or job.started_at or job.exported_at
+    now = now or datetime.utcnow()
+    return last_seen is not None and last_seen <= now - STALE_JOB_AFTER
+
+def is_active_job(job):
+    return job.status in ACTIVE_STATUSES and not is_stale_job(job)
+
+def _fail_stale_jobs(log_ids):
+    # Sesión propia: no mezclamos esta escritura con lo que tenga pendiente la sesión del llamador
+    db = SessionLocal()
+    try:
+        # Se vuelve a exigir la falta de latido: pudo renovarse desde que se listaron
+        db.query(ExportLog).filter(
+            ExportLog.id.in_(log_ids), ExportLog.status.in_(ACTIVE_STATUSES),
+            _last_seen() <= datetime.utcnow() - STALE_JOB_AFTER
+        ).update(
+            {ExportLog.status: JOB_FAILED, ExportLog.finished_at: datetime.utcnow(),
+             ExportLog.message: "Interrumpido: el proceso se reinició antes de terminar."},
+            synchronize_session=False
+        )
+        db.commit()
+        return True
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ No se pudieron marcar como fallidos los trabajos huérfanos {log_ids}: {e}")
+        return False
+    finally:
+        db.close()
+
+def get_jobs(db, week_id: int = None, limit: int = 10):
+    """
+    Últimos trabajos en segundo plano (para mostrar su estado en el panel).
+    Los huérfanos (ver is_stale_job) se marcan como fallidos al listarlos.
+    """
+    query = db.query(ExportLog).filter(ExportLog.job_kind.isnot(None))
+    if week_id is not None:
+        query = query.filter(ExportLog.week_id == week_id)
+    jobs = query.order_by(ExportLog.id.desc()).limit(limit).all()
+
+    stale = [job for job in jobs if is_stale_job(job)]
+    if stale and _fail_stale_jobs([job.id for job in stale]):
+        for job in stale:
+            db.expire(job)  # Se releen con el estado nuevo
+    return jobs
@@ -0,0 +1,124 @@
+# services/kitchen_service.py
+import pandas as pd
+from sqlalchemy import text, func
+from sqlalchemy.orm import Session
+from database.models import Week, MenuItem, Order, OrderLine, User, Office
+from services.export_service import (
+    DAY_KEYS, ENGLISH_TO_SPANISH, NO_OFFICE_LABEL, week_orders_query, parse_details
+)
+from services.order_service import DISH_FIELDS
+
+SUMMARY_COLUMNS = ["Oficina", "Día", "Tipo", "Plato", "Cantidad"]
+KITCHEN_SHEET = "Cocina"
+
+# --- CONTEO EN SQL (TABLA order_lines, INDEXADA) ---
+def _counts_from_order_lines(db: Session, week_id: int, office_id: int = None):
+    query = db.query(
+        Office.name, OrderLine.day, OrderLine.kind, OrderLine.menu_item_id, func.count(OrderLine.id)
+    ).join(Order, OrderLine.order_id == Order.id).join(User, Order.user_id == User.id).outerjoin(
+        Office, User.office_id == Office.id
+    ).filter(OrderLine.week_id == week_id, Order.status != "no_pedido")
+    if office_id is not None:
+        query = query.filter(User.office_id == office_id)
+    rows = query.group_by(Office.name, OrderLine.day, OrderLine.kind, OrderLine.menu_item_id).all()
+    counts = pd.DataFrame(rows, columns=["office", "day", "kind", "item_id", "qty"])
+    counts["office"] = counts["office"].fillna(NO_OFFICE_LABEL)
+    return counts
+
+# --- CONTEO SOBRE EL JSON (POSTGRES / JSONB) ---
+_PG_COUNT_SQL = """
+SELECT COALESCE(offices.name, :no_office) AS office, d.key AS day, k.kind AS kind,
+       d.value ->> k.field AS item_id, COUNT(*) AS qty
+FROM orders
+JOIN users ON users.id = orders.user_id
+LEFT JOIN offices ON offices.id = users.office_id
+CROSS JOIN LATERAL jsonb_each(orders.details::jsonb) AS d(key, value)
+JOIN (VALUES ('plato_id', 'Plato Completo', 'completo'),
+             ('proteina_id', 'Proteína', 'combinado'),
+             ('guarnicion_id', 'Guarnición', 'combinado')) AS k(field, kind, tipo)
+  ON d.value ->> 'tipo' = k.tipo
+WHERE orders.week_id = :week_id
+  AND orders.status <> 'no_pedido'
+  AND jsonb_typeof(d.value) = 'object'
+  AND d.value ->> k.field IS NOT NULL
+  {office_filter}
+GROUP BY 1, 2, 3, 4
+"""
+
+def _counts_from_postgres(db: Session, week_id: int, office_id: int = None):
+    office_filter = "AND users.office_id = :office_id" if office_id is not None else ""
+    params = {"week_id": week_id, "no_office": NO_OFFICE_LABEL}
+    if office_id is not None: params["office_id"] = office_id
+    rows = db.execute(text(_PG_COUNT_SQL.format(office_filter=office_filter)), params).all()
+    return pd.DataFrame(rows, columns=["office", "day", "kind", "item_id", "qty"])
+
+# --- CONTEO VECTORIZADO EN PANDAS (SQLITE / FALLBACK) ---
+def _counts_from_pandas(db: Session, week_id: int, office_id: int = None):
+    records = week_orders_query(db, week_id, office_id).all()
+    records = [r for r in records if r[0] != "no_pedido"]
+    empty = pd.DataFrame(columns=["office", "day", "kind", "item_id", "qty"])
+    if not records: return empty
+
+    # Una fila por pedido, columnas 'monday.tipo', 'monday.plato_id', ...
+    flat = pd.json_normalize([parse_details(r[1]) for r in records])
+    flat["office"] = [r[4] if r[4] else NO_OFFICE_LABEL for r in records]
+
+    # Formato largo: (pedido, día, campo, valor)
+    long = flat.reset_index().melt(id_vars=["index", "office"], var_name="campo", value_name="value")
+    parts = long["campo"].str.split(".", n=1, expand=True)
+    if parts.shape[1] < 2: return empty
+    long["day"], long["field"] = parts[0], parts[1]
+
+    tipos = long.loc[long["field"] == "tipo", ["index", "day", "value"]].rename(columns={"value": "tipo"})
+    dishes = long[long["field"].isin(DISH_FIELDS.keys())].merge(tipos, on=["index", "day"], how="inner")
+
+    fields = pd.DataFrame(
+        [(field, kind, tipo) for field, (kind, tipo) in DISH_FIELDS.items()],
+        columns=["field", "kind", "tipo"]
+    )
+    dishes = dishes.merge(fields, on=["field", "tipo"], how="inner")
+    dishes = dishes[dishes["value"].notna()].rename(columns={"value": "item_id"})
+    return dishes.groupby(["office", "day", "kind", "item_id"], as_index=False).size().rename(columns={"size": "qty"})
+
+# --- RESUMEN PARA COCINA ---
+def get_kitchen_summary(db: Session, week_id: int, office_id: int = None, by_office: bool = True):
+    """
+    Cuántos platos de cada tipo se preparan por día (y por oficina) en la semana.
+    El conteo se hace en SQL sobre order_lines. Si la semana todavía no tiene líneas
+    (base sin backfill), se cuenta sobre el JSON: JSONB en Postgres o pandas vectorizado.
+    """
+    week = db.query(Week).filter(Week.id == week_id).first()
+    if not week: return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+    counts = _counts_from_order_lines(db, week_id, office_id)
+    if counts.empty and db.get_bind().dialect.name == "postgresql":
+        # SAVEPOINT: si el JSON no es JSONB válido se deshace solo este intento, no la transacción del llamador
+        try:
+            with db.begin_nested():
+                counts = _counts_from_postgres(db, week_id, office_id)
+        except Exception as e:
+            print(f"⚠️ Conteo JSONB no disponible, usando pandas: {e}")
+    if counts.empty:
+        counts = _counts_from_pandas(db, week_id, office_id)
+
+    closed_days_list = week.closed_days if week.closed_days else []
+    counts = counts[counts["day"].isin(DAY_KEYS) & ~counts["day"].isin(closed_days_list)].copy()
+    if counts.empty: return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+    # IDs -> descripción con un solo lookup vectorizado
+    counts["item_id"] = pd.to_numeric(counts["item_id"], errors="coerce")
+    counts = counts[counts["item_id"].notna()]
+    ids = counts["item_id"].astype(int).unique().tolist()
+    descriptions = dict(db.query(MenuItem.id, MenuItem.description).filter(MenuItem.id.in_(ids)).all())
+    counts["Plato"] = counts["item_id"].astype(int).map(descriptions).fillna("Plato no encontrado")
+
+    group_cols = ["office", "day", "kind", "Plato"] if by_office else ["day", "kind", "Plato"]
+    summary = counts.groupby(group_cols, as_index=False)["qty"].sum()
+    if not by_office: summary["office"] = "Todas"
+
+    summary["day_order"] = summary["day"].map({d: i for i, d in enumerate(DAY_KEYS)})
+    summary = summary.sort_values(["office", "day_order", "kind", "qty"], ascending=[True, True, True, False])
+    summary["Día"] = summary["day"].map(ENGLISH_TO_SPANISH)
+    summary = summary.rename(columns={"office": "Oficina", "kind": "Tipo", "qty": "Cantidad"})
+    summary["Cantidad"] = summary["Cantidad"].astype(int)
+    return summary[SUMMARY_COLUMNS].reset_index(drop=True)
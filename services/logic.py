@@ -1,5 +1,7 @@
 # services/logic.py
-from database.models import Week, Order, MenuItem
+from database.models import Week, Order, OrderLine, MenuItem
+from services.scheduler import rearm_auto_close
+from services.cache import invalidate_menu, invalidate_open_week
 
 def delete_week_data(db, week_id):
     """Elimina una semana y todos sus datos asociados (pedidos, menú)."""
@@ -9,7 +11,8 @@ def delete_week_data(db, week_id):
         # 1. Eliminar items del menú (aunque el cascade debería hacerlo, aseguramos)
         db.query(MenuItem).filter(MenuItem.week_id == week_id).delete()
         
-        # 2. Eliminar pedidos asociados
+        # 2. Eliminar pedidos asociados (primero sus líneas normalizadas)
+        db.query(OrderLine).filter(OrderLine.week_id == week_id).delete()
         db.query(Order).filter(Order.week_id == week_id).delete()
         
         # 3. Eliminar logs de exportación si existen
@@ -18,5 +21,8 @@ def delete_week_data(db, week_id):
         # 4. Finalmente eliminar la semana
         db.delete(week)
         db.commit()
+        rearm_auto_close()
+        invalidate_menu(week_id)
+        invalidate_open_week()
         return True
     return False
\ No newline at end of file
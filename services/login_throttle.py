@@ -0,0 +1,207 @@
+# services/login_throttle.py
+# Límite de intentos de login en memoria del proceso: un script que martilla el formulario
+# no puede encolar un bcrypt (100-300 ms de CPU) por cada envío.
+# - Token bucket por usuario y por cliente: un intento rechazado cuesta microsegundos.
+# - Caché negativa de usuarios inexistentes: no se vuelve a consultar la BD por cada intento.
+# - Hash "dummy": un usuario inexistente tarda lo mismo que una contraseña incorrecta
+#   (la respuesta no revela qué usuarios existen).
+import secrets
+import threading
+import time
+from services.hashing import auth_setting, hash_password
+
+USER_BURST = auth_setting("login_user_burst", 5)              # Intentos seguidos por usuario
+USER_PER_MINUTE = auth_setting("login_user_per_minute", 5)    # Reposición por usuario
+# Por cliente el límite es holgado: una oficina entera sale por la misma IP (NAT) y entra junta antes del cierre
+CLIENT_BURST = auth_setting("login_client_burst", 100)        # Intentos seguidos por cliente (IP / sesión)
+CLIENT_PER_MINUTE = auth_setting("login_client_per_minute", 60)
+# Proxies propios delante de la app (0 = ninguno: X-Forwarded-For se ignora, lo puede escribir cualquiera)
+TRUSTED_PROXY_DEPTH = auth_setting("trusted_proxy_depth", 0)
+UNKNOWN_USER_TTL = auth_setting("login_unknown_user_ttl", 60)  # Segundos que se recuerda un usuario inexistente
+MAX_ENTRIES = 10000  # Tope de claves en memoria (buckets y caché negativa)
+
+# --- TOKEN BUCKET ---
+class TokenBuckets:
+    """Un bucket por clave: capacidad 'burst', se repone a 'per_minute' fichas por minuto."""
+
+    def __init__(self, burst: int, per_minute: int):
+        self.burst = max(burst, 1)
+        self.rate = max(per_minute, 1) / 60.0
+        self._lock = threading.Lock()
+        self._buckets = {}  # clave -> [fichas, última actualización]
+
+    def _refill(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return [float(self.burst), now]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        return bucket
+
+    def acquire(self, key):
+        """(True, 0) si hay ficha (y la consume); (False, segundos hasta la próxima) si no."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._refill(key, now)
+            if bucket[0] < 1:
+                return False, (1 - bucket[0]) / self.rate
+            bucket[0] -= 1
+            self._buckets[key] = bucket
+            if len(self._buckets) > MAX_ENTRIES:
+                self._prune(now)
+            return True, 0.0
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def _prune(self, now):
+        # Un bucket que ya se llenó de nuevo equivale a no tenerlo
+        for key in [k for k, (tokens, last) in self._buckets.items()
+                    if tokens + (now - last) * self.rate >= self.burst]:
+            del self._buckets[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._buckets)
+
+user_buckets = TokenBuckets(USER_BURST, USER_PER_MINUTE)
+client_buckets = TokenBuckets(CLIENT_BURST, CLIENT_PER_MINUTE)
+
+# --- CONTADORES ---
+_stats_lock = threading.Lock()
+_stats = {
+    "attempts": 0,            # Intentos recibidos
+    "throttled_user": 0,      # Rechazados por el bucket del usuario
+    "throttled_client": 0,    # Rechazados por el bucket del cliente
+    "unknown_cache_hits": 0,  # Usuario inexistente resuelto sin consultar la BD
+    "dummy_checks": 0,        # bcrypt contra el hash dummy (usuario inexistente)
+    "successes": 0,
+    "failures": 0,            # Contraseña incorrecta, usuario inexistente o inactivo
+}
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+def record_success(username: str):
+    """Login correcto: el usuario recupera todos sus intentos."""
+    _count("successes")
+    user_buckets.reset(_user_key(username))
+
+def record_failure():
+    _count("failures")
+
+def get_login_throttle_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    with _unknown_lock:
+        stats["unknown_cached"] = len(_unknown)
+    stats.update(
+        tracked_users=len(user_buckets), tracked_clients=len(client_buckets),
+        user_burst=USER_BURST, user_per_minute=USER_PER_MINUTE,
+        client_burst=CLIENT_BURST, client_per_minute=CLIENT_PER_MINUTE,
+    )
+    return stats
+
+# --- IDENTIDAD DEL CLIENTE ---
+def client_ip():
+    """
+    IP del navegador. Detrás de N proxies de confianza es la entrada N contando desde la derecha
+    de X-Forwarded-For (la que agregó nuestro proxy más externo); las de la izquierda las escribe
+    el cliente y no sirven. Sin proxies configurados, la IP de la conexión. None si no se sabe.
+    """
+    try:
+        import streamlit as st
+        if TRUSTED_PROXY_DEPTH > 0:
+            forwarded = [ip.strip() for ip in st.context.headers.get("X-Forwarded-For", "").split(",") if ip.strip()]
+            if len(forwarded) >= TRUSTED_PROXY_DEPTH:
+                return forwarded[-TRUSTED_PROXY_DEPTH]
+        return st.context.ip_address or None
+    except Exception:
+        return None
+
+def client_key():
+    """
+    IP del navegador (ver client_ip) o, si no se puede saber, la sesión de Streamlit.
+    Fuera de un rerun devuelve None (sin límite por cliente).
+    """
+    ip = client_ip()
+    if ip:
+        return "ip:" + ip
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        return "session:" + ctx.session_id if ctx else None
+    except Exception:
+        return None
+
+def _user_key(username: str):
+    return (username or "").strip().lower()
+
+def acquire(username: str, client: str = None):
+    """
+    Consume un intento del usuario y del cliente antes de gastar un bcrypt.
+    Devuelve (True, 0) o (False, segundos de espera).
+    """
+    _count("attempts")
+    if client:
+        ok, wait = client_buckets.acquire(client)
+        if not ok:
+            _count("throttled_client")
+            return False, wait
+    ok, wait = user_buckets.acquire(_user_key(username))
+    if not ok:
+        _count("throttled_user")
+        return False, wait
+    return True, 0.0
+
+# --- CACHÉ NEGATIVA DE USUARIOS INEXISTENTES ---
+_unknown_lock = threading.Lock()
+_unknown = {}  # usuario -> vence_en
+
+def is_unknown_user(username: str):
+    now = time.monotonic()
+    with _unknown_lock:
+        expires_at = _unknown.get(username)
+        if expires_at is None:
+            return False
+        if expires_at <= now:
+            del _unknown[username]
+            return False
+    _count("unknown_cache_hits")
+    return True
+
+def remember_unknown_user(username: str):
+    now = time.monotonic()
+    with _unknown_lock:
+        if len(_unknown) >= MAX_ENTRIES:
+            for name in [n for n, expires_at in _unknown.items() if expires_at <= now]:
+                del _unknown[name]
+            if len(_unknown) >= MAX_ENTRIES:
+                _unknown.clear()
+        _unknown[username] = now + UNKNOWN_USER_TTL
+
+def forget_unknown_user(username: str):
+    """El usuario acaba de crearse (o renombrarse): que el próximo login consulte la BD."""
+    with _unknown_lock:
+        _unknown.pop(username, None)
+
+# --- HASH DUMMY (TIEMPO CONSTANTE) ---
+_dummy_lock = threading.Lock()
+_dummy = [None]
+
+def dummy_password_hash():
+    """
+    Hash bcrypt de una contraseña aleatoria, con el costo configurado. Se calcula una vez por proceso,
+    al arrancar la app (ver app.py): si lo pagara el primer usuario inexistente, ese login haría dos bcrypt.
+    """
+    with _dummy_lock:
+        if _dummy[0] is None:
+            _dummy[0] = hash_password(secrets.token_urlsafe(16))
+        return _dummy[0]
+
+def dummy_check(password: str, verify):
+    """Usuario inexistente: misma verificación que uno real, contra el hash dummy."""
+    _count("dummy_checks")
+    verify(password, dummy_password_hash())
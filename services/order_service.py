@@ -1,37 +1,142 @@
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from database.models import Order
+from sqlalchemy.orm.exc import StaleDataError
+from database.models import Order, OrderLine
+from services.export_service import DAY_KEYS, parse_details
 from datetime import datetime
 
-def submit_order(db: Session, user_id: int, week_id: int, details: dict):
+STALE_ORDER_MSG = "⚠️ Tu pedido fue modificado desde otra sesión mientras lo editabas. Recargamos los datos actuales: revísalos y vuelve a guardar."
+
+# Campo del JSON -> (tipo de plato, 'tipo' de pedido que lo habilita)
+DISH_FIELDS = {
+    "plato_id": ("Plato Completo", "completo"),
+    "proteina_id": ("Proteína", "combinado"),
+    "guarnicion_id": ("Guarnición", "combinado"),
+}
+
+# --- LÍNEAS NORMALIZADAS ---
+def order_lines_from_details(details: dict):
+    """Convierte el JSON del pedido en filas (day, kind, menu_item_id) para la tabla order_lines.
+    Acepta también pedidos antiguos guardados como texto JSON."""
+    details = parse_details(details)
+    lines = []
+    for day in DAY_KEYS:
+        day_order = details.get(day) or {}
+        tipo = day_order.get("tipo", "nada")
+        for field, (kind, field_tipo) in DISH_FIELDS.items():
+            if tipo != field_tipo: continue
+            try: item_id = int(day_order.get(field))
+            except (TypeError, ValueError): continue
+            lines.append({"day": day, "kind": kind, "menu_item_id": item_id})
+    return lines
+
+def replace_order_lines(db: Session, order_id: int, week_id: int, details: dict):
+    """Reescribe las líneas del pedido. No hace commit: va en la misma transacción que el JSON."""
+    db.query(OrderLine).filter(OrderLine.order_id == order_id).delete(synchronize_session=False)
+    rows = [dict(line, order_id=order_id, week_id=week_id) for line in order_lines_from_details(details)]
+    if rows:
+        db.execute(insert(OrderLine), rows)
+
+def backfill_order_lines(db: Session, batch_size: int = 500):
+    """Genera order_lines para todos los pedidos existentes (idempotente). Devuelve cuántos pedidos procesó."""
+    processed = 0
+    last_id = 0
+    while True:
+        batch = db.query(Order.id, Order.week_id, Order.details).filter(Order.id > last_id).order_by(Order.id).limit(batch_size).all()
+        if not batch: break
+        order_ids = [order_id for order_id, _, _ in batch]
+        db.query(OrderLine).filter(OrderLine.order_id.in_(order_ids)).delete(synchronize_session=False)
+        rows = []
+        for order_id, week_id, details in batch:
+            rows.extend(dict(line, order_id=order_id, week_id=week_id) for line in order_lines_from_details(details))
+        if rows:
+            db.execute(insert(OrderLine), rows)
+        db.commit()
+        processed += len(batch)
+        last_id = order_ids[-1]
+    return processed
+
+def _upsert_insert(db: Session):
+    """insert() del dialecto con soporte ON CONFLICT (Postgres y SQLite); None si no hay."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        return dialect_insert
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        return dialect_insert
+    return None
+
+def _upsert_order(db: Session, dialect_insert, user_id: int, week_id: int, details: dict, new_status: str, expected_version):
+    # Un solo viaje: INSERT ... ON CONFLICT (user_id, week_id) DO UPDATE ... RETURNING
+    stmt = dialect_insert(Order).values(
+        user_id=user_id, week_id=week_id, details=details, status=new_status, created_at=datetime.utcnow(), version=1
+    )
+    # La versión se compara en el mismo UPDATE: si no coincide no se devuelve fila
+    version_check = None
+    if expected_version is not None:
+        version_check = Order.version == expected_version
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Order.user_id, Order.week_id],
+        set_={"details": stmt.excluded.details, "status": "actualizado", "created_at": stmt.excluded.created_at, "version": Order.version + 1},
+        where=version_check
+    ).returning(Order.id, Order.status)
+    row = db.execute(stmt).one_or_none()
+    if row is None: return None, True
+    order_id, status = row
+    return order_id, status == "actualizado"
+
+def _select_then_write_order(db: Session, user_id: int, week_id: int, details: dict, new_status: str, expected_version):
+    # Motores sin ON CONFLICT: buscamos y luego insertamos o actualizamos
+    existing_order = db.query(Order).filter(
+        Order.user_id == user_id, 
+        Order.week_id == week_id
+    ).first()
+
+    if existing_order:
+        if expected_version is not None and existing_order.version != expected_version:
+            return None, True
+        existing_order.details = details
+        existing_order.status = "actualizado"
+        existing_order.created_at = datetime.utcnow()
+        db.flush()
+        return existing_order.id, True
+
+    new_order = Order(user_id=user_id, week_id=week_id, details=details, status=new_status)
+    db.add(new_order)
+    db.flush() # Necesitamos el ID para las líneas
+    return new_order.id, False
+
+def submit_order(db: Session, user_id: int, week_id: int, details: dict, new_status: str = "success", expected_version: int = None):
+    """
+    Único camino de escritura de pedidos: crea o actualiza el pedido semanal del usuario.
+    En Postgres/SQLite es un solo upsert atómico, así dos envíos simultáneos no chocan
+    contra unique_order_per_week.
+    expected_version: versión del pedido que el usuario estaba editando (0 = no tenía pedido).
+    Si el pedido cambió desde entonces se devuelve (False, STALE_ORDER_MSG). None = sin control.
+    """
     try:
-        # 1. Buscamos si el usuario ya tiene un pedido para esta semana
-        existing_order = db.query(Order).filter(
-            Order.user_id == user_id, 
-            Order.week_id == week_id
-        ).first()
-
-        if existing_order:
-            # 2. Si existe, simplemente actualizamos el diccionario directamente
-            existing_order.details = details
-            existing_order.status = "actualizado"
-            existing_order.created_at = datetime.utcnow() # Actualizamos la fecha
-            msg = "Pedido actualizado correctamente."
+        dialect_insert = _upsert_insert(db)
+        if dialect_insert is not None:
+            order_id, updated = _upsert_order(db, dialect_insert, user_id, week_id, details, new_status, expected_version)
         else:
-            # 3. Si no existe, creamos uno nuevo pasándole el diccionario (details)
-            new_order = Order(
-                user_id=user_id, 
-                week_id=week_id, 
-                details=details, # SQLAlchemy lo convierte a JSON automáticamente
-                status="success"
-            )
-            db.add(new_order)
-            msg = "Pedido guardado con éxito."
+            order_id, updated = _select_then_write_order(db, user_id, week_id, details, new_status, expected_version)
+        if order_id is None:
+            db.rollback()
+            return False, STALE_ORDER_MSG
+        msg = "Pedido actualizado correctamente." if updated else "Pedido guardado con éxito."
             
-        # Guardamos los cambios
+        # Líneas normalizadas en la misma transacción que el JSON
+        replace_order_lines(db, order_id, week_id, details)
+        # Guardamos los cambios (la caché de exportación detecta el cambio por la versión del pedido)
         db.commit()
         return True, msg
         
+    except StaleDataError:
+        # Otro proceso actualizó la fila entre nuestra lectura y el UPDATE (camino sin upsert)
+        db.rollback()
+        return False, STALE_ORDER_MSG
     except Exception as e:
         # Si algo raro pasa (ej. se cae la conexión a Neon), deshacemos los cambios
         db.rollback()
-        return False, f"Error al procesar el pedido: {e}"
\ No newline at end of file
+        return False, f"Error al procesar el pedido: {e}"
@@ -0,0 +1,84 @@
+# services/scheduler.py
+import threading
+import time
+from sqlalchemy import func
+from database.connection import SessionLocal
+from database.models import Week
+
+# Aunque nadie nos avise, re-leemos los plazos cada tanto (semanas creadas desde otro proceso)
+MAX_SLEEP_SECONDS = 300
+# Margen para despertar justo DESPUÉS del cierre (check_and_auto_close_weeks usa end_date < ahora)
+DEADLINE_MARGIN_SECONDS = 1
+# Semana vencida que no se pudo cerrar (falló la exportación u otro proceso la está cerrando):
+# se reintenta con espera creciente, nunca en un bucle continuo
+MIN_RETRY_SECONDS = 60
+MAX_RETRY_SECONDS = 600
+MIN_SLEEP_SECONDS = 1
+
+_wakeup = threading.Event()
+_lock = threading.Lock()
+_thread = None
+
+def rearm_auto_close():
+    """Avisa al programador que cambiaron las semanas (creada, reabierta, editada o borrada)."""
+    _wakeup.set()
+
+def _next_deadline(db, now):
+    """Próximo plazo futuro (las semanas ya vencidas las maneja la espera de reintento)."""
+    return db.query(func.min(Week.end_date)).filter(Week.is_open == True, Week.end_date >= now).scalar()
+
+def _retry_delay(failures: int):
+    return min(MIN_RETRY_SECONDS * 2 ** (failures - 1), MAX_RETRY_SECONDS)
+
+def _run():
+    # Import diferido: admin_service importa este módulo para llamar a rearm_auto_close
+    from services.admin_service import check_and_auto_close_weeks, get_now_utc3, FINALIZE_DONE
+
+    retries = {}  # week_id -> (intentos fallidos, reintentar_en monotonic)
+    while True:
+        _wakeup.clear()
+        next_deadline = None
+        db = SessionLocal()
+        try:
+            now = time.monotonic()
+            waiting = {week_id for week_id, (_, retry_at) in retries.items() if retry_at > now}
+            results = check_and_auto_close_weeks(db, skip_week_ids=waiting)
+            closed_count = 0
+            for week_id, result in results.items():
+                if result is None: continue
+                if result.status == FINALIZE_DONE:
+                    closed_count += 1
+                    retries.pop(week_id, None)
+                else:
+                    failures = retries.get(week_id, (0, 0))[0] + 1
+                    delay = _retry_delay(failures)
+                    retries[week_id] = (failures, now + delay)
+                    print(f"⚠️ No se pudo cerrar la semana {week_id} ({result.status}): reintento en {delay}s.")
+            # Semanas que ya no están vencidas y abiertas (cerradas en otro proceso, reabiertas, borradas)
+            for week_id in list(retries):
+                if week_id not in results: retries.pop(week_id)
+            if closed_count > 0:
+                print(f"⚠️ SISTEMA: Se cerraron {closed_count} semanas automáticamente por horario.")
+            next_deadline = _next_deadline(db, get_now_utc3())
+        except Exception as e:
+            print(f"Error en el cierre automático programado: {e}")
+        finally:
+            db.close()
+
+        wait_seconds = MAX_SLEEP_SECONDS
+        if next_deadline is not None:
+            until_deadline = (next_deadline - get_now_utc3()).total_seconds() + DEADLINE_MARGIN_SECONDS
+            wait_seconds = min(until_deadline, wait_seconds)
+        if retries:
+            wait_seconds = min(min(retry_at for _, retry_at in retries.values()) - time.monotonic(), wait_seconds)
+        _wakeup.wait(max(MIN_SLEEP_SECONDS, wait_seconds))
+
+def start_auto_close_scheduler():
+    """Arranca (una sola vez por proceso) el hilo que cierra las semanas al llegar su plazo."""
+    global _thread
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return False
+        _thread = threading.Thread(target=_run, name="auto-close-scheduler", daemon=True)
+        _thread.start()
+        return True
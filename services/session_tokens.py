@@ -0,0 +1,168 @@
+# services/session_tokens.py
+# Token de sesión firmado (HMAC) que sobrevive a un refresh del navegador sin volver a pasar por bcrypt.
+# Contenido: user_id, rol, vencimiento, la "época" de sesiones del usuario y una huella del cliente.
+# Subir la época (desactivar al usuario, resetear su contraseña) invalida todos sus tokens emitidos.
+# El token viaja en una cookie (no en la URL: no queda en el historial, en logs ni en enlaces
+# compartidos) y solo vale desde el mismo navegador (IP + User-Agent) que inició sesión.
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+import streamlit as st
+from sqlalchemy.orm import Session
+from database.connection import SessionLocal
+from database.models import User
+from services.hashing import auth_setting
+from services.login_throttle import client_ip
+
+SESSION_COOKIE = "session"
+# Corto a propósito: la cookie no puede ser HttpOnly (ver write_session_cookie). Mientras se usa la app
+# el token se renueva solo (ver token_needs_renewal); lo que vence es una sesión inactiva.
+SESSION_TTL_HOURS = auth_setting("session_ttl_hours", 2)
+USER_CACHE_TTL = 30  # Segundos que se confía en el usuario cacheado (otro proceso pudo revocarlo)
+
+_secret_lock = threading.Lock()
+_secret = []  # [bytes o None] una vez resuelto
+
+def _session_secret():
+    """Secreto de firma (AUTH_SESSION_SECRET o [auth] session_secret); None si no está configurado."""
+    with _secret_lock:
+        if _secret: return _secret[0]
+        secret = os.environ.get("AUTH_SESSION_SECRET")
+        if not secret:
+            try:
+                if "auth" in st.secrets and "session_secret" in st.secrets.auth:
+                    secret = st.secrets.auth.session_secret
+            except Exception:
+                secret = None
+        if not secret:
+            # Sin secreto no se emiten tokens: el login dura lo que la sesión de Streamlit
+            print("⚠️ Sin [auth] session_secret: no se emiten tokens de sesión (un refresh pide la contraseña de nuevo).")
+        _secret.append(secret.encode("utf-8") if secret else None)
+        return _secret[0]
+
+def sessions_enabled():
+    return _session_secret() is not None
+
+def _b64(data: bytes):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _unb64(text: str):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(payload: str, secret: bytes):
+    return _b64(hmac.new(secret, payload.encode("utf-8"), hashlib.sha256).digest())
+
+def client_fingerprint():
+    """Huella del navegador (IP + User-Agent) a la que se ata el token. Fuera de un rerun: ""."""
+    try:
+        raw = f"{client_ip() or ''}|{st.context.headers.get('User-Agent', '')}"
+    except Exception:
+        return ""
+    return _b64(hashlib.sha256(raw.encode("utf-8")).digest()[:12])
+
+# --- USUARIO CACHEADO (SIN BCRYPT, A LO SUMO UNA CONSULTA) ---
+SessionUser = namedtuple("SessionUser", ["id", "role", "full_name", "is_active", "session_epoch"])
+
+_cache_lock = threading.Lock()
+_users = {}  # user_id -> (SessionUser, vence_en)
+
+def _get_session_user(user_id: int, db_session_maker=SessionLocal):
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _users.get(user_id)
+        if cached and cached[1] > now:
+            return cached[0]
+
+    db = db_session_maker()
+    try:
+        row = db.query(User.id, User.role, User.full_name, User.is_active, User.session_epoch).filter(User.id == user_id).first()
+    finally:
+        db.close()
+    user = SessionUser(*row) if row else None
+    with _cache_lock:
+        _users[user_id] = (user, now + USER_CACHE_TTL)
+    return user
+
+def forget_session_user(user_id: int):
+    """Descarta el usuario cacheado (llamar después del commit que lo modifica)."""
+    with _cache_lock:
+        _users.pop(user_id, None)
+
+# --- EMISIÓN Y VERIFICACIÓN ---
+def issue_session_token(user, client: str = "", ttl_hours: int = SESSION_TTL_HOURS):
+    """Token firmado para el usuario desde este cliente, o None si no hay secreto configurado."""
+    secret = _session_secret()
+    if secret is None: return None
+    expires = int(time.time()) + ttl_hours * 3600
+    payload = f"{user.id}:{user.role}:{expires}:{user.session_epoch or 0}:{client}"
+    return f"{_b64(payload.encode('utf-8'))}.{_sign(payload, secret)}"
+
+def verify_session_token(token: str, client: str = "", db_session_maker=SessionLocal):
+    """Devuelve el SessionUser si el token es válido, es de este cliente, está vigente y no fue revocado; si no, None."""
+    secret = _session_secret()
+    if secret is None: return None
+    try:
+        encoded, signature = token.split(".", 1)
+        payload = _unb64(encoded).decode("utf-8")
+    except Exception:
+        return None
+    if not hmac.compare_digest(signature, _sign(payload, secret)):
+        return None
+
+    try:
+        user_id, role, expires, epoch, token_client = payload.split(":")
+        user_id, expires, epoch = int(user_id), int(expires), int(epoch)
+    except ValueError:
+        return None
+    if expires < time.time() or not hmac.compare_digest(token_client, client):
+        return None
+
+    user = _get_session_user(user_id, db_session_maker)
+    if not user or not user.is_active: return None
+    # Época distinta = sesiones revocadas; rol distinto = permisos cambiados, que vuelva a entrar
+    if user.session_epoch != epoch or user.role != role: return None
+    return user
+
+def token_needs_renewal(token: str, ttl_hours: int = SESSION_TTL_HOURS):
+    """True si al token (ya verificado) le queda menos de la mitad de su vigencia."""
+    try:
+        payload = _unb64(token.split(".", 1)[0]).decode("utf-8")
+        expires = int(payload.split(":")[2])
+    except (ValueError, IndexError):
+        return False
+    return expires - time.time() < ttl_hours * 3600 / 2
+
+def revoke_user_sessions(db: Session, user_id: int):
+    """Invalida todos los tokens del usuario. No hace commit: va en la transacción del cambio."""
+    db.query(User).filter(User.id == user_id).update(
+        {User.session_epoch: User.session_epoch + 1}, synchronize_session=False
+    )
+
+# --- COOKIE ---
+# Streamlit no tiene API para escribir cookies: la escribe un script en la página (st.html no usa
+# iframe, así que la cookie queda en el dominio de la app) y se lee con st.context.cookies en la
+# próxima conexión (refresh o pestaña nueva).
+def read_session_cookie():
+    try:
+        return st.context.cookies.get(SESSION_COOKIE)
+    except Exception:
+        return None
+
+def write_session_cookie(token: str = None):
+    """
+    Guarda el token en la cookie del navegador; sin token la borra.
+    Limitación: al escribirla desde JavaScript la cookie NO puede ser HttpOnly, así que cualquier
+    script inyectado en la página puede leer el token. Lo acotan la huella del cliente (IP +
+    User-Agent), SameSite=Strict y un SESSION_TTL_HOURS corto con renovación mientras hay actividad.
+    """
+    max_age = SESSION_TTL_HOURS * 3600 if token else 0
+    cookie = json.dumps(f"{SESSION_COOKIE}={token or ''}; Max-Age={max_age}; Path=/; SameSite=Strict")
+    st.html(
+        f"<script>document.cookie = {cookie} + (location.protocol === 'https:' ? '; Secure' : '');</script>",
+        unsafe_allow_javascript=True,
+    )
@@ -0,0 +1,55 @@
+# services/user_import.py
+# Lectura de la planilla de alta masiva de usuarios (CSV o Excel) para auth.bulk_create_users.
+# Una fila por persona; las columnas se aceptan en castellano o en inglés.
+import os
+import pandas as pd
+
+# Encabezado aceptado -> clave que espera bulk_create_users
+COLUMN_ALIASES = {
+    "usuario": "username", "username": "username", "login": "username",
+    "nombre": "full_name", "nombre completo": "full_name", "full_name": "full_name",
+    "contraseña": "password", "contrasena": "password", "password": "password",
+    "oficina": "office", "office": "office",
+    "rol": "role", "role": "role",
+}
+REQUIRED = ("username", "full_name", "password", "office")
+TEMPLATE_COLUMNS = ["usuario", "nombre", "contraseña", "oficina", "rol"]
+
+def read_user_rows(source, filename: str):
+    """
+    source: ruta o archivo abierto (ej. el UploadedFile de Streamlit); filename decide CSV o Excel.
+    Devuelve (filas, None) o ([], mensaje de error). Cada fila trae 'row' = número de fila en la planilla.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    try:
+        if extension in (".xlsx", ".xlsm"):
+            df = pd.read_excel(source, dtype=str)
+        elif extension == ".csv":
+            # sep=None detecta ',' o ';' (Excel en castellano exporta con ';')
+            df = pd.read_csv(source, dtype=str, sep=None, engine="python", encoding="utf-8-sig", keep_default_na=False)
+        else:
+            return [], f"Formato no soportado: '{extension}'. Use .csv o .xlsx."
+    except Exception as e:
+        return [], f"No se pudo leer el archivo: {e}"
+
+    df = df.rename(columns=lambda c: COLUMN_ALIASES.get(str(c).strip().lower(), str(c).strip().lower()))
+    missing = [c for c in REQUIRED if c not in df.columns]
+    if missing:
+        return [], f"Faltan columnas: {', '.join(missing)}. Esperadas: {', '.join(TEMPLATE_COLUMNS)}."
+    if "role" not in df.columns:
+        df["role"] = ""
+
+    df = df[list(REQUIRED) + ["role"]].fillna("")
+    rows = []
+    # Fila 1 = encabezado: la primera persona está en la fila 2 de la planilla
+    for row_number, values in enumerate(df.itertuples(index=False), start=2):
+        row = dict(zip(df.columns, values))
+        if not any(str(v).strip() for v in row.values()):
+            continue  # Fila vacía al final de la planilla
+        row["row"] = row_number
+        rows.append(row)
+    return rows, None
+
+def template_csv():
+    """Planilla de ejemplo para descargar desde la vista."""
+    return pd.DataFrame(columns=TEMPLATE_COLUMNS).to_csv(index=False).encode("utf-8-sig")
@@ -2,23 +2,77 @@
 import streamlit as st
 from database.models import Week, MenuItem, Office 
 from services.admin_service import (
-    create_week, finalize_week_logic, update_menu_item, delete_menu_item, 
-    export_week_to_excel, get_all_offices, create_office, delete_office,
+    create_week, update_menu_item, delete_menu_item, 
+    get_all_offices, create_office, delete_office,
     update_week_closed_days, create_menu_item, reopen_week_logic,
     clone_menu_from_week  # <-- AQUÍ ESTÁ LA NUEVA FUNCIÓN IMPORTADA
 )
 from services.logic import delete_week_data 
+from database.connection import get_pool_status, get_replica_status
+from services.hashing import get_hash_metrics
+from services.login_throttle import get_login_throttle_stats
+from services.export_service import XLSX_MIME
+from services.kitchen_service import get_kitchen_summary
+from services.job_queue import (
+    submit_job, get_jobs, is_active_job, JOB_EXPORT, JOB_BUNDLE, JOB_BUNDLE_ZIP, JOB_FINALIZE
+)
 from sqlalchemy.orm import Session
 from datetime import datetime, time, timedelta
 import pandas as pd
 import os
 import time as time_module # Para el pequeño delay antes de recargar
 
+JOB_STATUS_LABELS = {"queued": "🕒 En cola", "running": "⚙️ Procesando", "done": "✅ Listo", "failed": "❌ Error"}
+JOB_KIND_LABELS = {"export": "Exportación", "bundle": "Excel por oficina", "bundle_zip": "ZIP por oficina", "finalize": "Cierre de semana"}
+
+def _submit_export(kind, week_id, office_id=None):
+    _, is_new = submit_job(kind, week_id, office_id, created_by=st.session_state.get("user_name"))
+    if is_new: st.success("Exportación encolada. Puedes seguir usando el panel.")
+    else: st.info("Ya hay una exportación igual en curso.")
+
+def _render_export_jobs(jobs, week_id, office_names=None):
+    if not jobs:
+        st.caption("Sin trabajos para esta semana.")
+        return
+    for job in jobs:
+        c1, c2 = st.columns([3, 1])
+        duration = f" · {job.duration_ms / 1000:.1f}s" if job.duration_ms is not None else ""
+        cache = " · caché" if job.cache_hit else ""
+        target = ""
+        if job.job_kind == JOB_EXPORT:
+            target = f" · {(office_names or {}).get(job.office_id, 'Consolidado')}"
+        c1.write(f"{JOB_STATUS_LABELS.get(job.status, job.status)} **{JOB_KIND_LABELS.get(job.job_kind, job.job_kind)}**{target} #{job.id}{duration}{cache}")
+        if job.status == "failed" and job.message: c1.caption(job.message)
+        if job.status == "done" and job.filename and os.path.exists(job.filename):
+            is_zip = job.filename.endswith(".zip")
+            with open(job.filename, "rb") as f:
+                c2.download_button(
+                    label="⬇️ Descargar",
+                    data=f,
+                    file_name=job.filename.split("/")[-1],
+                    mime="application/zip" if is_zip else XLSX_MIME,
+                    key=f"dl_job_{job.id}_{week_id}",
+                    use_container_width=True
+                )
+
+@st.fragment(run_every=2)
+def _poll_export_jobs(db_session_maker, week_id):
+    # Se re-ejecuta solo este bloque cada 2s mientras haya trabajos activos
+    db = db_session_maker()
+    try:
+        jobs = get_jobs(db, week_id)
+        office_names = {o.id: o.name for o in get_all_offices(db)}
+    finally:
+        db.close()
+    if not any(is_active_job(j) for j in jobs):
+        st.rerun()  # Todo terminó: recarga completa (estado de la semana, botones, etc.)
+    _render_export_jobs(jobs, week_id, office_names)
+
 def admin_dashboard(db_session_maker):
     st.title("📋 Gestión Semanal y Oficinas")
     
     # Definición de pestañas
-    tab1, tab2, tab3, tab4 = st.tabs(["📅 Semanas", "🍔 Menú y Feriados", "🏢 Oficinas", "🔒 Cierre/Exportación"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📅 Semanas", "🍔 Menú y Feriados", "🏢 Oficinas", "🔒 Cierre/Exportación", "⚙️ Sistema"])
     
     db: Session = db_session_maker() 
 
@@ -216,34 +270,41 @@ def admin_dashboard(db_session_maker):
             all_offices = get_all_offices(db)
             if not all_offices: st.warning("No hay oficinas configuradas.")
             
+            # --- RESUMEN PARA COCINA ---
+            if st.toggle("🍳 Ver resumen para Cocina (cantidades por día y plato)", key=f"kitchen_{sel_week_ex_id}"):
+                kitchen_opts = {"Todas las Oficinas (total)": None, "Todas las Oficinas (por oficina)": "by_office"}
+                kitchen_opts.update({o.name: o.id for o in all_offices})
+                sel_kitchen = st.selectbox("Agrupar", list(kitchen_opts.keys()), key=f"kitchen_off_{sel_week_ex_id}")
+                kitchen_val = kitchen_opts[sel_kitchen]
+                if kitchen_val is None:
+                    kitchen_df = get_kitchen_summary(db, sel_week_ex_id, by_office=False)
+                elif kitchen_val == "by_office":
+                    kitchen_df = get_kitchen_summary(db, sel_week_ex_id)
+                else:
+                    kitchen_df = get_kitchen_summary(db, sel_week_ex_id, office_id=kitchen_val)
+                if kitchen_df.empty: st.info("No hay platos pedidos en esta semana.")
+                else: st.dataframe(kitchen_df, use_container_width=True, hide_index=True)
+                st.markdown("---")
+            
             st.info("Generar reporte individual por oficina:")
-            for office in all_offices:
-                col_btn, col_dl = st.columns([1, 1])
-                with col_btn:
-                    if st.button(f"📄 {office.name}", key=f"btn_exp_{office.id}_{sel_week_ex_id}", use_container_width=True):
-                        path, msg = export_week_to_excel(db, sel_week_ex_id, office.id)
-                        if path: 
-                            st.session_state[f"last_export_{office.id}"] = path
-                            st.success(msg)
-                        else: st.error(msg)
-                with col_dl:
-                    if f"last_export_{office.id}" in st.session_state:
-                        path = st.session_state[f"last_export_{office.id}"]
-                        if os.path.exists(path):
-                            with open(path, "rb") as f:
-                                st.download_button(
-                                    label=f"⬇️ Descargar {office.name}", 
-                                    data=f, 
-                                    file_name=path.split("/")[-1],
-                                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                    key=f"dl_{office.id}_{sel_week_ex_id}"
-                                )
-
+            office_cols = st.columns(3)
+            for i, office in enumerate(all_offices):
+                if office_cols[i % 3].button(f"📄 {office.name}", key=f"btn_exp_{office.id}_{sel_week_ex_id}", use_container_width=True):
+                    _submit_export(JOB_EXPORT, sel_week_ex_id, office.id)
+            if st.button("📄 Consolidado (una sola hoja, todas las oficinas)", use_container_width=True, key=f"btn_consolidated_{sel_week_ex_id}"):
+                _submit_export(JOB_EXPORT, sel_week_ex_id)
             st.markdown("---")
-            if st.button("📦 Exportar TODAS las Oficinas (Consolidado)", type="primary"):
-                path, msg = export_week_to_excel(db, sel_week_ex_id, None)
-                if path:
-                    with open(path, "rb") as f: st.download_button("⬇️ Descargar Consolidado", f, file_name=path.split("/")[-1])
+            
+            # Una sola pasada sobre los pedidos: hoja por oficina + consolidado, o ZIP por oficina
+            st.info("Generar reporte de todas las oficinas en un solo archivo:")
+            bundle_format = st.radio(
+                "Formato", ["📗 Un Excel (hoja por oficina + Consolidado)", "🗜️ ZIP (un Excel por oficina)"],
+                horizontal=True, key=f"bundle_fmt_{sel_week_ex_id}"
+            )
+            as_zip = bundle_format.startswith("🗜️")
+            
+            if st.button("📦 Exportar TODAS las Oficinas", type="primary", use_container_width=True, key=f"btn_bundle_{sel_week_ex_id}"):
+                _submit_export(JOB_BUNDLE_ZIP if as_zip else JOB_BUNDLE, sel_week_ex_id)
             
             # --- ZONA DE CIERRE Y REAPERTURA ---
             w_obj = db.query(Week).filter(Week.id == sel_week_ex_id).first()
@@ -252,8 +313,9 @@ def admin_dashboard(db_session_maker):
                 if w_obj.is_open:
                     st.error("🚫 Zona de Cierre Manual")
                     if st.button("🔒 CERRAR SEMANA AHORA"):
-                        path, msg = finalize_week_logic(db, sel_week_ex_id)
-                        st.success("Semana cerrada."); st.rerun()
+                        _, is_new = submit_job(JOB_FINALIZE, sel_week_ex_id, created_by=st.session_state.get("user_name"))
+                        if is_new: st.success("Cierre encolado. La semana se cerrará en segundo plano.")
+                        else: st.info("El cierre de esta semana ya está en curso.")
                 else:
                     st.success("🔓 Zona de Reapertura")
                     st.info("Si reabres la semana, los usuarios podrán volver a hacer pedidos o editar los que ya tenían.")
@@ -265,5 +327,57 @@ def admin_dashboard(db_session_maker):
                             st.rerun()
                         else:
                             st.error(msg)
+            
+            # --- ESTADO DE TRABAJOS EN SEGUNDO PLANO ---
+            st.markdown("---")
+            st.markdown("#### ⏳ Trabajos de Exportación")
+            jobs = get_jobs(db, sel_week_ex_id)
+            if any(is_active_job(j) for j in jobs):
+                _poll_export_jobs(db_session_maker, sel_week_ex_id)
+            else:
+                _render_export_jobs(jobs, sel_week_ex_id, {o.id: o.name for o in all_offices})
+    
+    # --- TAB 5: SISTEMA (POOL DE CONEXIONES) ---
+    with tab5:
+        st.subheader("🔌 Pool de Conexiones a la Base de Datos")
+        pool = get_pool_status()
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("En uso", pool["checked_out"], help=f"Tamaño del pool: {pool['pool_size']}")
+        c2.metric("Overflow", f"{pool['overflow']} / {pool['max_overflow']}")
+        c3.metric("Espera promedio", f"{pool['avg_wait_ms']:.1f} ms", help=f"Máxima: {pool['max_wait_ms']:.1f} ms")
+        c4.metric("Timeouts", pool["timeouts"], help=f"Checkouts totales: {pool['checkouts']}")
+        st.markdown("**Latencia de checkout (histograma)**")
+        st.bar_chart(pd.DataFrame({"Checkouts": pool["histogram"]}))
+        
+        st.subheader("🪞 Réplica de Lectura")
+        replica = get_replica_status()
+        if not replica["configured"]:
+            st.info("Sin réplica configurada: reportes y exportaciones leen de la base principal.")
+        elif replica["usable"]:
+            st.success(f"Reportes y exportaciones leen de la réplica (retraso {replica['lag_seconds']:.1f}s, máximo {replica['max_lag_seconds']}s).")
+        else:
+            detail = replica["error"] or f"retraso {replica['lag_seconds']}s > {replica['max_lag_seconds']}s"
+            st.warning(f"Réplica no disponible ({detail}): se lee de la base principal.")
+        
+        st.subheader("🔑 Hashing de Contraseñas (bcrypt)")
+        hashing = get_hash_metrics()
+        h1, h2, h3, h4 = st.columns(4)
+        h1.metric("En cola", hashing["queue_depth"], help=f"Máximo observado: {hashing['max_queue_depth']}")
+        h2.metric("Latencia promedio", f"{hashing['avg_ms']:.0f} ms", help=f"p95: {hashing['p95_ms']:.0f} ms (incluye espera en cola)")
+        h3.metric("Procesados", hashing["completed"], help=f"Errores: {hashing['errors']}")
+        h4.metric("Costo / Procesos", f"{hashing['rounds']} / {hashing['workers']}")
+        
+        st.subheader("🚦 Límite de Intentos de Login")
+        throttle = get_login_throttle_stats()
+        l1, l2, l3, l4 = st.columns(4)
+        l1.metric("Intentos", throttle["attempts"], help=f"Correctos: {throttle['successes']} · Fallidos: {throttle['failures']}")
+        l2.metric("Frenados por usuario", throttle["throttled_user"],
+                  help=f"{throttle['user_burst']} seguidos, {throttle['user_per_minute']}/min · Usuarios seguidos: {throttle['tracked_users']}")
+        l3.metric("Frenados por cliente", throttle["throttled_client"],
+                  help=f"{throttle['client_burst']} seguidos, {throttle['client_per_minute']}/min · Clientes seguidos: {throttle['tracked_clients']}")
+        l4.metric("Usuarios inexistentes", throttle["dummy_checks"],
+                  help=f"Resueltos sin consultar la BD: {throttle['unknown_cache_hits']} · En caché: {throttle['unknown_cached']}")
+        if st.button("🔄 Actualizar métricas"):
+            st.rerun()
     
     db.close()
\ No newline at end of file
@@ -1,8 +1,9 @@
 # views/user_management.py
 import streamlit as st
-from database.models import User
-from services.auth import create_user, update_user_details, reset_user_password
+from services.auth import create_user, update_user_details, reset_user_password, bulk_create_users
+from services.user_import import read_user_rows, template_csv
 from services.admin_service import get_all_offices # Importamos función para obtener oficinas
+from services.cache import get_user_directory
 from sqlalchemy.orm import Session
 import pandas as pd
 
@@ -25,21 +26,21 @@ def user_management_dashboard(db_session_maker):
     office_map = {o.name: o.id for o in offices_list} if offices_list else {}
 
     # Usamos Tabs para separar Crear de Editar
-    tab_list, tab_create = st.tabs(["🛠️ Administrar Existentes", "➕ Crear Nuevo"])
+    tab_list, tab_create, tab_import = st.tabs(["🛠️ Administrar Existentes", "➕ Crear Nuevo", "📥 Importar Planilla"])
 
     # --- TAB 1: LISTADO Y EDICIÓN ---
     with tab_list:
         st.subheader("Directorio de Usuarios")
         
-        # 1. Listado rápido (Dataframe)
-        users = db.query(User).all()
+        # 1. Listado rápido (Dataframe) - instantánea compartida, se recarga solo si cambian usuarios/oficinas
+        users = get_user_directory(db)
         if not users:
             st.info("No hay usuarios registrados.")
         else:
             # Mostramos Login, Nombre, Rol y Oficina
             user_data = []
             for u in users:
-                off_name = u.office.name if u.office else "Sin Oficina"
+                off_name = u.office_name if u.office_name else "Sin Oficina"
                 user_data.append({
                     "ID": u.id, 
                     "Usuario (Login)": u.username, 
@@ -60,7 +61,7 @@ def user_management_dashboard(db_session_maker):
         
         if selected_label:
             target_id = user_options[selected_label]
-            target_user = db.query(User).filter(User.id == target_id).first()
+            target_user = next(u for u in users if u.id == target_id)
             
             # Formulario de Edición de Datos
             with st.form("edit_user_form"):
@@ -75,9 +76,9 @@ def user_management_dashboard(db_session_maker):
                 
                 # Selector de Oficina con valor actual por defecto
                 current_off_index = 0
-                if target_user.office and target_user.office.name in office_map:
+                if target_user.office_name and target_user.office_name in office_map:
                     keys_list = list(office_map.keys())
-                    current_off_index = keys_list.index(target_user.office.name)
+                    current_off_index = keys_list.index(target_user.office_name)
                 
                 selected_office_name = c4.selectbox("Oficina", list(office_map.keys()), index=current_off_index)
                 selected_office_id = office_map.get(selected_office_name)
@@ -137,4 +138,27 @@ def user_management_dashboard(db_session_maker):
                 else:
                     st.warning("Todos los campos son obligatorios (incluyendo Oficina).")
 
+    # --- TAB 3: ALTA MASIVA (CSV / EXCEL) ---
+    with tab_import:
+        st.subheader("Importar Usuarios desde Planilla")
+        st.caption("Columnas: usuario, nombre, contraseña, oficina (nombre exacto) y rol (opcional: user o admin). "
+                   "Las filas con error se informan y no se crean; el resto se guarda en una sola operación.")
+        st.download_button("⬇️ Descargar planilla de ejemplo", template_csv(), "usuarios.csv", "text/csv")
+        
+        uploaded = st.file_uploader("Archivo CSV o Excel", type=["csv", "xlsx"], key="bulk_users_file")
+        if uploaded:
+            rows, read_error = read_user_rows(uploaded, uploaded.name)
+            if read_error:
+                st.error(read_error)
+            else:
+                st.info(f"{len(rows)} filas leídas de '{uploaded.name}'.")
+                if st.button("📥 Importar Usuarios", type="primary"):
+                    with st.spinner("Validando y creando usuarios..."):
+                        created, errors = bulk_create_users(db, rows)
+                    if created:
+                        st.success(f"✅ {created} usuarios creados.")
+                    if errors:
+                        st.warning(f"⚠️ {len(errors)} filas con error (no se crearon):")
+                        st.dataframe(pd.DataFrame(errors), use_container_width=True, hide_index=True)
+
     db.close()
@@ -1,7 +1,9 @@
 import streamlit as st
 from sqlalchemy.orm import Session
-from database.models import Week, MenuItem, Order
+from database.models import Order
 from services.admin_service import get_now_utc3
+from services.order_service import submit_order, STALE_ORDER_MSG
+from services.cache import get_week_menu, get_open_week
 import time
 
 # --- FUNCIONES DE BLOQUEO MUTUO PARA STREAMLIT ---
@@ -14,49 +16,11 @@ def seleccionar_completo(dia_code):
 
 # --- FUNCIONES AUXILIARES ---
 def get_full_week_menu(db: Session, week_id: int):
-    items = db.query(MenuItem).filter(MenuItem.week_id == week_id).all()
-    menu_structure = {day: {'Proteína': [], 'Guarnición': [], 'Plato Completo': []} 
-                      for day in ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']}
-    
-    for item in items:
-        if item.day in menu_structure and item.type in menu_structure[item.day]:
-            menu_structure[item.day][item.type].append(item)
-    return menu_structure
+    # Menú compartido por todas las sesiones (services/cache.py): no se consulta en cada rerun
+    return get_week_menu(db, week_id)
 
 def get_item_name_by_id(menu_structure, day_code, item_type, item_id):
-    if not item_id: return None
-    items = menu_structure.get(day_code, {}).get(item_type, [])
-    for item in items:
-        if item.id == item_id:
-            return item.description
-    return "Plato no encontrado"
-
-def save_weekly_order_to_db(db: Session, user_id: int, week_id: int, collected_data: dict):
-    try:
-        existing_order = db.query(Order).filter(
-            Order.user_id == user_id, 
-            Order.week_id == week_id
-        ).first()
-
-        if existing_order:
-            existing_order.details = collected_data
-            existing_order.status = "actualizado"
-            msg = "✅ Pedido actualizado correctamente."
-        else:
-            new_order = Order(
-                user_id=user_id,
-                week_id=week_id,
-                status="confirmado",
-                details=collected_data
-            )
-            db.add(new_order)
-            msg = "🚀 Pedido creado exitosamente."
-        
-        db.commit()
-        return True, msg
-    except Exception as e:
-        db.rollback()
-        return False, f"Error al guardar: {e}"
+    return menu_structure.description(day_code, item_type, item_id)
 
 # --- INTERFAZ DE USUARIO ---
 def user_dashboard(db_session_maker):
@@ -69,10 +33,8 @@ def user_dashboard(db_session_maker):
 
     try:
         now_utc3 = get_now_utc3()
-        current_week = db.query(Week).filter(
-            Week.is_open == True, 
-            Week.end_date > now_utc3
-        ).order_by(Week.start_date.desc()).first()
+        # Semana vigente cacheada en el proceso: la entrada vence sola en el end_date
+        current_week = get_open_week(db, now_utc3)
 
         if not current_week:
             st.info("🚫 No hay semanas habilitadas para pedidos.")
@@ -126,10 +88,15 @@ def user_dashboard(db_session_maker):
             
             st.session_state.week_data_loaded = True
             st.session_state.current_week_id = current_week.id
+            # Versión sobre la que se edita (0 = sin pedido previo) para detectar guardados cruzados
+            st.session_state.order_version_loaded = existing_order.version if existing_order else 0
 
         # 3. HEADER Y TEXTO DE INSTRUCCIONES
         st.title(f"🍽️ Menú: {current_week.title}")
         
+        if st.session_state.get("order_conflict_msg"):
+            st.warning(st.session_state.pop("order_conflict_msg"))
+        
         st.info("ℹ️ **Información:** Solo puedes llenar una de las dos secciones (Plato Combinado o Plato Completo). Para Plato Combinado necesitas pedir **obligatoriamente** Proteína y Guarnición, no es posible enviar uno solo.")
 
         # ---------------------------------------------------------
@@ -188,7 +155,7 @@ def user_dashboard(db_session_maker):
                 
                 with tab:
                     st.subheader(f"📅 {current_day_name}")
-                    day_items = full_menu.get(current_day_code)
+                    day_items = full_menu.days.get(current_day_code)
                     
                     if current_day_code in closed_days:
                         st.error(f"⛔ {current_day_name}: FERIADO / SIN SERVICIO")
@@ -199,15 +166,15 @@ def user_dashboard(db_session_maker):
                         continue
 
                     # Preparar opciones
-                    prot_opts = {p.description: p.id for p in day_items.get('Proteína', [])}
+                    prot_opts = full_menu.options(current_day_code, 'Proteína')
                     prot_opts["Ninguno"] = None
                     prot_list = list(prot_opts.keys())
                     
-                    guar_opts = {g.description: g.id for g in day_items.get('Guarnición', [])}
+                    guar_opts = full_menu.options(current_day_code, 'Guarnición')
                     guar_opts["Ninguno"] = None
                     guar_list = list(guar_opts.keys())
                     
-                    comp_opts = {c.description: c.id for c in day_items.get('Plato Completo', [])}
+                    comp_opts = full_menu.options(current_day_code, 'Plato Completo')
                     comp_opts["Ninguno"] = None
                     comp_list = list(comp_opts.keys())
 
@@ -277,19 +244,14 @@ def user_dashboard(db_session_maker):
                     validation_error = False 
                     
                     for i, d in enumerate(days_keys):
-                        d_items = full_menu.get(d, {})
-                        p_opts = {p.description: p.id for p in d_items.get('Proteína', [])}
-                        g_opts = {g.description: g.id for g in d_items.get('Guarnición', [])}
-                        c_opts = {c.description: c.id for c in d_items.get('Plato Completo', [])}
-
                         prot_name = st.session_state.get(f"widget_proteina_{d}")
                         guar_name = st.session_state.get(f"widget_guarnicion_{d}")
                         comp_name = st.session_state.get(f"widget_completo_{d}")
                         nota = st.session_state.get(f"widget_note_{d}", "")
                         
-                        prot_id = p_opts.get(prot_name) if prot_name and prot_name != "Ninguno" else None
-                        guar_id = g_opts.get(guar_name) if guar_name and guar_name != "Ninguno" else None
-                        comp_id = c_opts.get(comp_name) if comp_name and comp_name != "Ninguno" else None
+                        prot_id = full_menu.id_for(d, 'Proteína', prot_name) if prot_name and prot_name != "Ninguno" else None
+                        guar_id = full_menu.id_for(d, 'Guarnición', guar_name) if guar_name and guar_name != "Ninguno" else None
+                        comp_id = full_menu.id_for(d, 'Plato Completo', comp_name) if comp_name and comp_name != "Ninguno" else None
 
                         if comp_id is not None:
                             final_data_payload[d] = {"tipo": "completo", "plato_id": comp_id, "note": nota}
@@ -310,7 +272,10 @@ def user_dashboard(db_session_maker):
                         if count_meals == 0:
                             st.warning("⚠️ No has seleccionado ningún plato para ningún día.")
                         else:
-                            success, msg = save_weekly_order_to_db(db, user_id, current_week.id, final_data_payload)
+                            success, msg = submit_order(
+                                db, user_id, current_week.id, final_data_payload, new_status="confirmado",
+                                expected_version=st.session_state.get("order_version_loaded")
+                            )
                             if success:
                                 st.balloons()
                                 st.success(msg)
@@ -318,6 +283,12 @@ def user_dashboard(db_session_maker):
                                 st.session_state.week_data_loaded = False # Limpia estado al guardar exitosamente
                                 time.sleep(1.5)
                                 st.rerun()
+                            elif msg == STALE_ORDER_MSG:
+                                # Otro guardado ganó: recargamos lo que hay en la BD y seguimos editando
+                                st.session_state.order_conflict_msg = msg
+                                st.session_state.is_editing_order = True
+                                st.session_state.week_data_loaded = False
+                                st.rerun()
                             else:
                                 st.error(msg)
 